@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from api import routes
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/health/live", summary="Liveness probe")
+async def liveness():
+    """
+    The process is up and the event loop is serving requests. Never touches
+    the database, so an outage does not get healthy workers restarted.
+    """
+    return {"status": "alive"}
+
+
+@router.get("/health/ready", summary="Readiness probe",
+            responses={503: {"description": "The database is not available yet, or was lost"}})
+async def readiness():
+    """
+    Whether this worker can serve course requests: `200` once the database
+    is connected and its schema ensured, `503` while it is still connecting
+    or after a failed health check. The body reports the connection state,
+    the number of failed attempts and the last error.
+    """
+    return JSONResponse(routes.database.status(), status_code=200 if routes.database.ready else 503)
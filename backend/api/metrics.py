@@ -0,0 +1,219 @@
+"""
+Request and database metrics, served in Prometheus text format on /metrics.
+
+MetricsMiddleware times every request per route template (so /items/1
+and /items/2 share one series) and collects the time and number of
+queries the request spent in the database, as recorded by the query
+monitor in db/instrument.py. Request latency minus database time is what
+the request spent in Python: validation, serialization and the handler.
+
+Long-lived connections would swamp those histograms with their lifetime:
+event streams (the SSE change stream) are only counted, and leave the
+in-flight gauge once their headers are sent; WebSockets are not measured.
+Open change streams are reported by the change feed's own metrics.
+"""
+
+import logging
+import time
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from api import routes
+from db.instrument import RequestQueries, query_monitor, request_queries
+from db.pool import Histogram
+
+# Upper bounds (seconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the queries-per-request histogram buckets.
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Responses that stay open until the client leaves; counted, not timed.
+STREAM_CONTENT_TYPES = (b"text/event-stream",)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class RequestMetrics:
+    """
+    Per-route request counters and histograms. Only touched from the event
+    loop, so the dicts need no lock; the histograms carry their own.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = {}
+        self.latency = {}
+        self.db_seconds = {}
+        self.db_queries = {}
+        self.over_budget = {}
+        self.compiles = {}
+
+    def _histogram(self, series, labels, buckets):
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(buckets)
+        return histogram
+
+    def observe(self, method, route, status, seconds, queries, over_budget=False, stream=False):
+        labels = (method, route)
+        if over_budget:
+            self.over_budget[labels] = self.over_budget.get(labels, 0) + 1
+        if queries.compiles:
+            self.compiles[labels] = self.compiles.get(labels, 0) + queries.compiles
+        self.requests[labels + (status,)] = self.requests.get(labels + (status,), 0) + 1
+        if stream:
+            return
+        self._histogram(self.latency, labels, LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.db_seconds, labels, LATENCY_BUCKETS).observe(queries.seconds)
+        self._histogram(self.db_queries, labels, QUERY_COUNT_BUCKETS).observe(queries.count)
+
+
+METRICS = RequestMetrics()
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware overhead or body buffering)."""
+
+    def __init__(self, app, metrics=None):
+        self.app = app
+        self.metrics = metrics or METRICS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stream = False
+
+        async def send_with_status(message):
+            nonlocal status, stream
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                if content_type.startswith(STREAM_CONTENT_TYPES):
+                    stream = True
+                    self.metrics.in_flight -= 1
+                exceeded = query_monitor.over_budget(queries)
+                if exceeded:
+                    # Flag it on the response too, so it shows up in tests and browser tools.
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-budget-exceeded", ", ".join(exceeded).encode())
+                    ]
+            await send(message)
+
+        queries = RequestQueries(scope)
+        token = request_queries.set(queries)
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            if not stream:
+                self.metrics.in_flight -= 1
+            request_queries.reset(token)
+            # The router stores the matched route in the scope; unmatched
+            # paths share one label to keep the series count bounded.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            exceeded = query_monitor.over_budget(queries)
+            if exceeded:
+                logger.warning("%s exceeded its database budget: %s", queries.route, ", ".join(exceeded))
+            self.metrics.observe(scope["method"], route, str(status), elapsed, queries, bool(exceeded), stream)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _histogram_lines(name, label_names, series):
+    for label_values, histogram in sorted(series.items()):
+        snapshot = histogram.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            yield f"{name}_bucket{_labels(label_names + ('le',), label_values + (bound,))} {count}"
+        yield f"{name}_sum{_labels(label_names, label_values)} {snapshot['sum']}"
+        yield f"{name}_count{_labels(label_names, label_values)} {snapshot['count']}"
+
+
+def _metric(name, kind, help_text, lines):
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} {kind}"
+    yield from lines
+
+
+def render_metrics(metrics=None, db=None, cache=None, changes=None):
+    """Render request, query, pool, cache and change feed metrics as Prometheus text."""
+    metrics = metrics or METRICS
+    route_labels = ("method", "route")
+    out = []
+    out += _metric("http_requests_in_flight", "gauge", "Requests currently being served.",
+                   [f"http_requests_in_flight {metrics.in_flight}"])
+    out += _metric("http_requests_total", "counter", "Requests served, by route and status.",
+                   [f"http_requests_total{_labels(route_labels + ('status',), key)} {count}"
+                    for key, count in sorted(metrics.requests.items())])
+    out += _metric("http_request_duration_seconds", "histogram", "Request latency.",
+                   _histogram_lines("http_request_duration_seconds", route_labels, metrics.latency))
+    out += _metric("http_request_db_seconds", "histogram", "Time each request spent executing queries.",
+                   _histogram_lines("http_request_db_seconds", route_labels, metrics.db_seconds))
+    out += _metric("http_request_db_queries", "histogram", "Queries executed per request.",
+                   _histogram_lines("http_request_db_queries", route_labels, metrics.db_queries))
+    out += _metric("http_requests_over_budget_total", "counter",
+                   "Requests that exceeded DB_QUERY_BUDGET or DB_ROW_BUDGET.",
+                   [f"http_requests_over_budget_total{_labels(route_labels, key)} {count}"
+                    for key, count in sorted(metrics.over_budget.items())])
+
+    out += _metric("db_query_duration_seconds", "histogram", "Duration of every executed statement.",
+                   _histogram_lines("db_query_duration_seconds", (), {(): query_monitor.duration}))
+    out += _metric("db_slow_queries_total", "counter", "Statements slower than DB_SLOW_QUERY_MS.",
+                   [f"db_slow_queries_total {query_monitor.slow_queries}"])
+    out += _metric("db_statement_cache_total", "counter",
+                   "Executed statements, by whether their compiled SQL came from the cache.",
+                   [f'db_statement_cache_total{{result="{result}"}} {count}'
+                    for result, count in sorted(query_monitor.statement_cache.items())])
+    out += _metric("http_request_db_compiles_total", "counter",
+                   "Statements compiled (compiled cache misses) while serving a route.",
+                   [f"http_request_db_compiles_total{_labels(route_labels, key)} {count}"
+                    for key, count in sorted(metrics.compiles.items())])
+
+    if db is not None:
+        pool = db.pool_stats()
+        for key in ("size", "checked_in", "checked_out", "overflow"):
+            if key in pool:
+                out += _metric(f"db_pool_{key}", "gauge", f"Connection pool {key.replace('_', ' ')}.",
+                               [f"db_pool_{key} {pool[key]}"])
+        out += _metric("db_pool_timeouts_total", "counter", "Connection checkouts that timed out.",
+                       [f"db_pool_timeouts_total {pool['timeouts']}"])
+        out += _metric("db_pool_wait_seconds", "histogram", "Time spent waiting for a pooled connection.",
+                       _histogram_lines("db_pool_wait_seconds", (), {(): db.pool_monitor.wait_seconds}))
+
+    if cache is not None:
+        out += _metric("cache_requests_total", "counter", "Read-through cache lookups, by result.",
+                       [f'cache_requests_total{{result="{result}"}} {count}'
+                        for result, count in sorted(cache.stats().items())])
+
+    if changes is not None:
+        feed = changes.stats()
+        out += _metric("changes_subscribers", "gauge", "Open change streams in this worker.",
+                       [f"changes_subscribers {feed['subscribers']}"])
+        out += _metric("changes_published_total", "counter", "Changes published to the change streams.",
+                       [f"changes_published_total {feed['seq']}"])
+        out += _metric("changes_overflows_total", "counter",
+                       "Change streams closed because the client fell CHANGES_QUEUE_SIZE changes behind.",
+                       [f"changes_overflows_total {feed['overflows']}"])
+    return "\n".join(out) + "\n"
+
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(
+        render_metrics(db=routes.database.ops, cache=routes.cache, changes=routes.changes),
+        media_type=PROMETHEUS_CONTENT_TYPE,
+    )
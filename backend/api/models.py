@@ -0,0 +1,75 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class CourseBase(BaseModel):
+    name: str = Field(..., description="The name of the course", example="Python Programming")
+    description: str = Field(..., description="Course description", example="Learn Python from basics to advanced")
+    price: float = Field(..., gt=0, description="Course price in USD", example=99.99)
+
+class Course(CourseBase):
+    id: int = Field(..., description="Unique identifier for the course", example=1)
+
+class CourseCreate(CourseBase):
+    id: Optional[int] = Field(None, description="Unique identifier for the course; leave unset to have one assigned", example=1)
+
+class CourseUpdate(BaseModel):
+    name: Optional[str] = Field(None, description="The name of the course", example="Python Programming")
+    description: Optional[str] = Field(None, description="Course description", example="Learn Python from basics to advanced")
+    price: Optional[float] = Field(None, gt=0, description="Course price in USD", example=99.99)
+
+class CourseResponse(BaseModel):
+    message: str
+    course: Course
+
+class MessageResponse(BaseModel):
+    message: str
+
+class CoursePage(BaseModel):
+    items: List[Course]
+    next_cursor: Optional[str] = Field(None, description="Pass as `after` to fetch the next page; null on the last page")
+
+class CourseSearchResult(Course):
+    rank: float = Field(..., description="Relevance score; results are ordered by it, best first")
+
+class SearchResults(BaseModel):
+    query: str
+    items: List[CourseSearchResult]
+
+class CourseStats(BaseModel):
+    count: int = Field(..., description="Number of matching courses")
+    min_price: Optional[float] = Field(None, description="Lowest price; null when nothing matches")
+    max_price: Optional[float] = Field(None, description="Highest price; null when nothing matches")
+    avg_price: Optional[float] = Field(None, description="Average price, rounded to cents")
+    total_price: Optional[float] = Field(None, description="Sum of all prices")
+
+class BulkError(BaseModel):
+    index: int = Field(..., description="Zero-based position of the row in the request")
+    error: str
+
+class BulkCreateResponse(BaseModel):
+    message: str
+    inserted: int
+    failed: int
+    errors: List[BulkError]
+
+class CourseFilter(BaseModel):
+    name: Optional[str] = Field(None, description="Courses whose name contains this text (case-insensitive)")
+    min_price: Optional[float] = Field(None, ge=0, description="Minimum price (inclusive)")
+    max_price: Optional[float] = Field(None, ge=0, description="Maximum price (inclusive)")
+
+class CoursePatch(CourseUpdate):
+    id: int = Field(..., description="ID of the course to update", example=1)
+
+class BulkUpdateRequest(BaseModel):
+    ids: Optional[List[int]] = Field(None, description="IDs of the courses to update")
+    filter: Optional[CourseFilter] = Field(None, description="Update every course matching these filters")
+    values: Optional[CourseUpdate] = Field(None, description="Values to set on every selected course")
+    items: Optional[List[CoursePatch]] = Field(None, description="Per-course values, instead of ids/filter/values")
+
+class BulkDeleteRequest(BaseModel):
+    ids: Optional[List[int]] = Field(None, description="IDs of the courses to delete")
+    filter: Optional[CourseFilter] = Field(None, description="Delete every course matching these filters")
+
+class BulkWriteResponse(BaseModel):
+    message: str
+    affected: int = Field(..., description="Number of courses changed")
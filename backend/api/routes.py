@@ -1,49 +1,214 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
-from db.ops import PostgresOps
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from api import fast_json
+from api.models import (
+    BulkCreateResponse, BulkDeleteRequest, BulkError, BulkUpdateRequest, BulkWriteResponse,
+    Course, CourseCreate, CourseFilter, CoursePage, CourseResponse, CourseStats, CourseUpdate,
+    MessageResponse, SearchResults,
+)
+from db.cache import NullCache, ReadThroughCache, cache_from_env
+from db.changes import RESET, change_feed_from_env
+from db.instrument import exempt_row_budget
+from db.manager import manager_from_env
+from db.ops import COPY_THRESHOLD, IDEMPOTENCY_TABLE, IdempotencyKeyReused, PostgresOps, sortable_columns
+from db.schema import items_table
+from sqlalchemy import MetaData
+from sqlalchemy.exc import IntegrityError
+from typing import List, Dict, Any, Literal, Optional
+import base64
+import binascii
+import csv
+import hashlib
+import inspect
+import io
+import json
 import os
 
 router = APIRouter()
 
-# Initialize database connection with environment variable support
-try:
-    # Check if DATABASE_URL is provided (common in CI/CD environments)
+# DB_ASYNC=true selects the asyncio database layer (asyncpg/aiosqlite);
+# otherwise the sync ops run on FastAPI's threadpool.
+USE_ASYNC_DB = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# Create/migrate the schema once the database is reachable. Deployments
+# that run `python migrate.py` as a release step can set
+# DB_ENSURE_SCHEMA=false so workers start without touching the schema.
+ENSURE_SCHEMA = os.getenv("DB_ENSURE_SCHEMA", "true").lower() in ("1", "true", "yes")
+
+# Seconds an Idempotency-Key is remembered; older keys are purged by the
+# database manager's housekeeping and can be reused.
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+
+def create_ops():
+    # DATABASE_URL wins over the individual DB_* variables.
     database_url = os.getenv("DATABASE_URL")
-    if database_url:
-        db = PostgresOps(database_url=database_url)
-    else:
-        db = PostgresOps()
-    
-    # Create table if it doesn't exist
-    db.create_table("items", ["id", "name", "description", "price"])
+    if USE_ASYNC_DB:
+        from db.async_ops import AsyncSQLAlchemyOps
+        return AsyncSQLAlchemyOps(database_url=database_url)
+    return PostgresOps(database_url=database_url)
+
+# Connected in the background once the app starts (see main.lifespan), so
+# a missing database neither blocks startup nor needs a restart to recover.
+database = manager_from_env(
+    create_ops,
+    tables=["items", IDEMPOTENCY_TABLE] if ENSURE_SCHEMA else [],
+    housekeeping=[("purge_idempotency_keys", IDEMPOTENCY_KEY_TTL)],
+)
+
+def get_db():
+    """Dependency returning the ops object, or 503 while the database is unavailable."""
+    if database.ops is None or not database.ready:
+        raise HTTPException(status_code=503, detail="Database connection not available")
+    return database.ops
+
+# Read-through cache in front of the course reads (see db/cache.py).
+try:
+    cache = cache_from_env()
 except Exception as e:
-    print(f"Warning: Database connection failed: {e}")
-    print("Some endpoints may not work properly without a database connection.")
-    db = None
+    print(f"Warning: Cache setup failed, continuing without a cache: {e}")
+    cache = ReadThroughCache(NullCache())
+
+# Course changes for GET /items/changes, fed by the items table's NOTIFY
+# trigger on PostgreSQL (see main.lifespan) and by this worker's own
+# writes elsewhere.
+changes = change_feed_from_env()
+
+# Seconds between keepalive comments on an idle change stream, and the
+# reconnect delay (milliseconds) suggested to EventSource clients.
+CHANGES_KEEPALIVE = float(os.getenv("CHANGES_KEEPALIVE", "15"))
+CHANGES_RETRY_MS = 1000
+
+async def call_db(method, *args, **kwargs):
+    """Await async ops methods directly; run sync ones in the threadpool."""
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    return await run_in_threadpool(method, *args, **kwargs)
+
+def make_etag(value):
+    """Strong ETag for a JSON-serializable value, derived from its content."""
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(payload.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(header, etag, weak=True):
+    # If-None-Match uses weak comparison (W/ prefixes ignored); If-Match
+    # uses strong comparison, where weak validators never match.
+    if header is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+async def check_if_match(db, item_id, if_match):
+    """
+    Enforce If-Match for a write. Returns the condition the write must use:
+    when a precondition is given, it pins every column to the values the
+    client saw, so a concurrent change makes the write match no rows.
+    """
+    if if_match is None:
+        return {"id": item_id}
+    current = await call_db(db.fetch_one, "items", item_id)
+    if current is None or not etag_matches(if_match, make_etag(current), weak=False):
+        raise HTTPException(status_code=412, detail="Precondition failed: course has changed")
+    return dict(current)
+
+CONDITIONAL_RESPONSES = {
+    304: {"description": "Not modified (the `If-None-Match` ETag is current)"},
+}
+PRECONDITION_RESPONSES = {
+    412: {"description": "Precondition failed (the `If-Match` ETag is stale)"},
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Rows validated from an NDJSON stream are flushed to the database in
+# chunks of this size, so a large upload is never held in memory at once.
+# Full chunks are exactly large enough for bulk_insert to load them with
+# COPY on PostgreSQL (DB_COPY_THRESHOLD).
+BULK_FLUSH_SIZE = COPY_THRESHOLD
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Columns the list can be sorted by: the primary key and indexed columns.
+SORT_COLUMNS = sorted(sortable_columns(items_table(MetaData())))
 
-class CourseBase(BaseModel):
-    name: str = Field(..., description="The name of the course", example="Python Programming")
-    description: str = Field(..., description="Course description", example="Learn Python from basics to advanced")
-    price: float = Field(..., gt=0, description="Course price in USD", example=99.99)
+EXPORT_COLUMNS = ("id", "name", "description", "price")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
 
-class Course(CourseBase):
-    id: int = Field(..., description="Unique identifier for the course", example=1)
+def filter_condition(name=None, min_price=None, max_price=None):
+    """Condition dict for the list filters shared by the read endpoints."""
+    condition = {}
+    if name:
+        condition["name__contains"] = name
+    if min_price is not None:
+        condition["price__gte"] = min_price
+    if max_price is not None:
+        condition["price__lte"] = max_price
+    return condition
 
-class CourseCreate(CourseBase):
-    id: int = Field(..., description="Unique identifier for the course", example=1)
+def parse_sort(sort):
+    """Split `price` / `-price` into (column, descending); None means id order."""
+    if sort is None:
+        return None, False
+    descending = sort.startswith("-")
+    column = sort[1:] if descending else sort
+    if column not in SORT_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot sort by '{column}'; sortable columns: {', '.join(SORT_COLUMNS)}",
+        )
+    return column, descending
 
-class CourseUpdate(BaseModel):
-    name: Optional[str] = Field(None, description="The name of the course", example="Python Programming")
-    description: Optional[str] = Field(None, description="Course description", example="Learn Python from basics to advanced")
-    price: Optional[float] = Field(None, gt=0, description="Course price in USD", example=99.99)
+def encode_cursor(sort, position):
+    # Sorted pages continue from (sort value, id); the cursor is opaque to clients.
+    raw = json.dumps([sort, *position], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-class CourseResponse(BaseModel):
-    message: str
-    course: Course
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, key = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort order")
+    return value, key
 
-class MessageResponse(BaseModel):
-    message: str
+def bulk_condition(ids: Optional[List[int]], filter: Optional[CourseFilter]):
+    """
+    Condition selecting the courses for a bulk write. Refuses an empty
+    selection, so a missing body field can never touch the whole table.
+    """
+    condition = filter_condition(**filter.model_dump()) if filter is not None else {}
+    if ids is not None:
+        condition["id__in"] = ids
+    if not condition:
+        raise HTTPException(status_code=400, detail="Select courses with `ids` or a non-empty `filter`")
+    return condition
+
+def encode_export_batch(rows, format, header=False):
+    if format == "ndjson":
+        return b"".join(fast_json.encode_json(row) + b"\n" for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue().encode()
     
 
 @router.post("/items/", response_model=CourseResponse, status_code=201,
@@ -83,8 +248,9 @@ class MessageResponse(BaseModel):
                         }
                     }
                 },
+                409: {"description": "A course with this id already exists"},
                 422: {
-                    "description": "Validation Error",
+                    "description": "Validation Error (or an `Idempotency-Key` reused for a different course)",
                     "content": {
                         "application/json": {
                             "examples": {
@@ -120,104 +286,554 @@ class MessageResponse(BaseModel):
                     }
                 }
             })
-def create_item(
+async def create_item(
     item: CourseCreate,
+    response: Response,
+    db=Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255,
+                                            description="Makes retries safe: a repeated key returns the original response"),
     summary="Create a new course",
     description="Create a new course with the provided details"
 ):
     """
     Create a new course with all the information:
     
-    - **id**: Unique identifier for the course
+    - **id**: Unique identifier for the course (optional: leave it out to
+      have the database assign the next one; the response carries it)
     - **name**: Course name
     - **description**: Detailed course description
     - **price**: Course price (must be greater than 0)
+    
+    A course whose id is taken is rejected with `409`. Send an
+    `Idempotency-Key` header (any unique string, e.g. a UUID) to make
+    retries safe: repeating the request with the same key returns the
+    course created by the first one, marked `Idempotent-Replayed: true`,
+    instead of creating it again or failing.
     """
-    if db is None:
-        raise HTTPException(status_code=503, detail="Database connection not available")
+    row = item.model_dump(exclude_none=True)
+    try:
+        if idempotency_key:
+            fingerprint = hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()
+            created, replayed = await call_db(db.insert_idempotent, "items", row, idempotency_key, fingerprint)
+        else:
+            created, replayed = await call_db(db.insert_returning, "items", row), False
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IntegrityError:
+        if item.id is None:
+            # A generated id is reserved before any explicit write of it
+            # commits, but an explicit write that got there first wins.
+            raise HTTPException(status_code=409, detail="The assigned course id was taken concurrently; retry")
+        raise HTTPException(status_code=409, detail=f"Course {item.id} already exists")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    else:
+        await cache.invalidate_lists("items")
+        changes.publish_local({"op": "insert", "id": created["id"], "row": created})
+    return CourseResponse(message="Course created successfully!", course=Course(**created))
+
+async def _iter_bulk_rows(request: Request):
+    """
+    Yield rows from a JSON array body (as dicts) or an NDJSON stream (as
+    raw lines, so a malformed line is reported like any other bad row).
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type in NDJSON_MEDIA_TYPES:
+        pending = b""
+        async for chunk in request.stream():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+    else:
+        rows = json.loads(await request.body())
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array of courses")
+        for row in rows:
+            yield row
+
+@router.post("/items/bulk", response_model=BulkCreateResponse, status_code=201,
+            summary="Create many courses",
+            openapi_extra={
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {"type": "array", "items": {"$ref": "#/components/schemas/CourseCreate"}}
+                        },
+                        "application/x-ndjson": {
+                            "schema": {"type": "string", "description": "One CourseCreate JSON object per line"}
+                        }
+                    }
+                }
+            })
+async def create_items_bulk(request: Request, db=Depends(get_db)):
+    """
+    Create many courses in one request.
+    
+    Send a JSON array of courses, or stream one course per line with
+    `Content-Type: application/x-ndjson`. Rows that fail validation or
+    cannot be inserted (e.g. duplicate ids) are reported in `errors` with
+    their position; every other row is still inserted.
+    """
+    inserted = 0
+    errors = []
+    batch, positions = [], []
+    
+    async def flush():
+        nonlocal inserted
+        count, failures = await call_db(db.bulk_insert, "items", batch)
+        inserted += count
+        if count:
+            await cache.invalidate_lists("items")
+            changes.publish_local(RESET)
+        errors.extend(BulkError(index=positions[i], error=message) for i, message in failures)
+        batch.clear()
+        positions.clear()
+    
+    try:
+        index = 0
+        async for raw in _iter_bulk_rows(request):
+            try:
+                if isinstance(raw, bytes):
+                    item = CourseCreate.model_validate_json(raw)
+                else:
+                    item = CourseCreate.model_validate(raw)
+            except ValidationError as e:
+                errors.append(BulkError(index=index, error=str(e)))
+            else:
+                batch.append(item.model_dump(exclude_none=True))
+                positions.append(index)
+                if len(batch) >= BULK_FLUSH_SIZE:
+                    await flush()
+            index += 1
+        if batch:
+            await flush()
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    errors.sort(key=lambda err: err.index)
+    return BulkCreateResponse(
+        message=f"{inserted} courses created successfully!",
+        inserted=inserted,
+        failed=len(errors),
+        errors=errors,
+    )
+
+@router.put("/items/bulk", response_model=BulkWriteResponse, summary="Create or replace many courses")
+async def upsert_items_bulk(items: List[Course], db=Depends(get_db)):
+    """
+    Create or replace every course in the list in one transaction, with
+    `INSERT ... ON CONFLICT DO UPDATE`: courses whose id exists are
+    overwritten, the rest are created. Safe to retry, and no reads are
+    needed to decide between insert and update. If an id appears more than
+    once, the last entry wins. Returns the number of courses written.
+    """
+    try:
+        stored = await call_db(db.upsert, "items", [item.model_dump() for item in items])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if stored:
+        await cache.invalidate_rows("items", *(row["id"] for row in stored))
+        changes.publish_local(RESET)
+    return BulkWriteResponse(message=f"Saved {len(stored)} courses", affected=len(stored))
+
+@router.patch("/items/bulk", response_model=BulkWriteResponse, summary="Update many courses")
+async def update_items_bulk(request: BulkUpdateRequest, db=Depends(get_db)):
+    """
+    Update many courses in one transaction.
+    
+    - Set the same `values` on every course selected by `ids` and/or
+      `filter` (one UPDATE statement), or
+    - send `items`, each with an `id` and its own new values (one batched
+      statement per set of changed fields).
     
+    Returns the number of courses updated.
+    """
     try:
-        db.insert_data("items", [item.id, item.name, item.description, item.price])
-        course = Course(id=item.id, name=item.name, description=item.description, price=item.price)
-        return CourseResponse(message="Course created successfully!", course=course)
+        if request.items is not None:
+            if request.ids is not None or request.filter is not None or request.values is not None:
+                raise HTTPException(status_code=400, detail="Send either `items` or a selection with `values`, not both")
+            rows = [item.model_dump(exclude_none=True) for item in request.items]
+            if any(len(row) == 1 for row in rows):
+                raise HTTPException(status_code=400, detail="No fields to update")
+            affected = await call_db(db.update_many, "items", rows)
+            updated_ids = [row["id"] for row in rows]
+        else:
+            condition = bulk_condition(request.ids, request.filter)
+            values = request.values.model_dump(exclude_none=True) if request.values is not None else {}
+            if not values:
+                raise HTTPException(status_code=400, detail="No fields to update")
+            updated_ids = await call_db(db.update_where, "items", values, condition)
+            affected = len(updated_ids)
+        
+        if affected:
+            await cache.invalidate_rows("items", *updated_ids)
+            changes.publish_local(RESET)
+        return BulkWriteResponse(message=f"{affected} courses updated successfully!", affected=affected)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/items/bulk", response_model=BulkWriteResponse, summary="Delete many courses")
+async def delete_items_bulk(request: BulkDeleteRequest, db=Depends(get_db)):
+    """
+    Delete every course selected by `ids` and/or `filter` with a single
+    DELETE statement. Returns the number of courses deleted.
+    """
+    try:
+        condition = bulk_condition(request.ids, request.filter)
+        deleted_ids = await call_db(db.delete_where, "items", condition)
+        if deleted_ids:
+            await cache.invalidate_rows("items", *deleted_ids)
+            changes.publish_local(RESET)
+        return BulkWriteResponse(message=f"{len(deleted_ids)} courses deleted successfully!", affected=len(deleted_ids))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/items/", response_model=List[Course],
+@router.get("/items/", response_model=CoursePage,
            responses={
+               **CONDITIONAL_RESPONSES,
                200: {
-                   "description": "List of all courses",
+                   "description": "One page of courses, ordered by id",
                    "content": {
                        "application/json": {
                            "examples": {
-                               "multiple_courses": {
-                                   "summary": "Multiple Courses",
-                                   "description": "Example response with multiple courses",
-                                   "value": [
-                                       {
-                                           "id": 1,
-                                           "name": "Python Programming",
-                                           "description": "Learn Python from basics to advanced",
-                                           "price": 99.99
-                                       },
-                                       {
-                                           "id": 2,
-                                           "name": "Full Stack Web Development",
-                                           "description": "Complete MERN stack development course",
-                                           "price": 149.99
-                                       },
-                                       {
-                                           "id": 3,
-                                           "name": "Data Science with Python",
-                                           "description": "Machine learning and data analysis",
-                                           "price": 199.99
-                                       }
-                                   ]
+                               "first_page": {
+                                   "summary": "Page With More Results",
+                                   "description": "Example response when further pages exist",
+                                   "value": {
+                                       "items": [
+                                           {
+                                               "id": 1,
+                                               "name": "Python Programming",
+                                               "description": "Learn Python from basics to advanced",
+                                               "price": 99.99
+                                           },
+                                           {
+                                               "id": 2,
+                                               "name": "Full Stack Web Development",
+                                               "description": "Complete MERN stack development course",
+                                               "price": 149.99
+                                           }
+                                       ],
+                                       "next_cursor": "2"
+                                   }
+                               },
+                               "last_page": {
+                                   "summary": "Last Page",
+                                   "description": "Response for the final page of results",
+                                   "value": {
+                                       "items": [
+                                           {
+                                               "id": 3,
+                                               "name": "Data Science with Python",
+                                               "description": "Machine learning and data analysis",
+                                               "price": 199.99
+                                           }
+                                       ],
+                                       "next_cursor": None
+                                   }
                                },
                                "empty_list": {
                                    "summary": "Empty Course List",
-                                   "description": "Response when no courses exist",
-                                   "value": []
-                               },
-                               "single_course": {
-                                   "summary": "Single Course",
-                                   "description": "Response with only one course",
-                                   "value": [
-                                       {
-                                           "id": 1,
-                                           "name": "Python Programming",
-                                           "description": "Learn Python from basics to advanced",
-                                           "price": 99.99
-                                       }
-                                   ]
+                                   "description": "Response when no courses match",
+                                   "value": {"items": [], "next_cursor": None}
                                }
                            }
                        }
                    }
                }
            })
-def read_items(
+async def read_items(
+    response: Response,
+    db=Depends(get_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of courses to return"),
+    after: Optional[str] = Query(None, description="Cursor from a previous page's `next_cursor`"),
+    name: Optional[str] = Query(None, description="Only courses whose name contains this text (case-insensitive)"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price (inclusive)"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price (inclusive)"),
+    sort: Optional[str] = Query(None, description="Sort column, `-` prefix for descending, e.g. `-price` (default: id)"),
+    if_none_match: Optional[str] = Header(None),
     summary="Get all courses",
-    description="Retrieve a list of all available courses"
+    description="Retrieve a page of courses"
 ):
     """
-    Retrieve all courses from the database.
+    Retrieve courses from the database, one page at a time.
     
-    Returns a list of courses with their details.
+    Pages are keyed on the course id: pass the returned `next_cursor` as
+    `after` to continue. Optional filters narrow the results by name and
+    price range, and `sort` orders them by another indexed column (`name`,
+    `price`; prefix `-` for descending), still paged by cursor. Responses
+    carry an `ETag`; send it back in `If-None-Match` to get
+    `304 Not Modified` while the page is unchanged.
     """
-    if db is None:
-        raise HTTPException(status_code=503, detail="Database connection not available")
+    sort_column, descending = parse_sort(sort)
+    sorted_page = sort_column is not None and (sort_column != "id" or descending)
+    if sorted_page:
+        after_id = decode_cursor(after, sort) if after is not None else None
+    else:
+        try:
+            after_id = int(after) if after is not None else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    condition = filter_condition(name, min_price, max_price)
+    
+    try:
+        async def load_page():
+            courses, next_id = await call_db(db.fetch_page, "items", limit, after=after_id, condition=condition,
+                                             sort=sort_column, descending=descending)
+            if next_id is None:
+                next_cursor = None
+            else:
+                next_cursor = encode_cursor(sort, next_id) if sorted_page else str(next_id)
+            # The ETag is computed once per load and cached with the page.
+            page = {"items": courses, "next_cursor": next_cursor, "etag": make_etag([courses, next_cursor])}
+            if fast_json.FAST_JSON:
+                # So is the encoded body: cache hits skip serialization entirely.
+                page["body"] = fast_json.encode_json({"items": courses, "next_cursor": next_cursor}).decode()
+            return page
+        
+        key = await cache.list_key("items", limit=limit, after=after_id, sort=sort, **condition)
+        page = await cache.get_or_load(key, load_page)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if etag_matches(if_none_match, page["etag"]):
+        return not_modified(page["etag"])
+    if fast_json.FAST_JSON:
+        body = page.get("body") or {"items": page["items"], "next_cursor": page["next_cursor"]}
+        return fast_json.json_response(body, headers={"ETag": page["etag"], "Cache-Control": "no-cache"})
+    response.headers["ETag"] = page["etag"]
+    response.headers["Cache-Control"] = "no-cache"
+    return CoursePage(items=page["items"], next_cursor=page["next_cursor"])
+
+@router.get("/items/export", summary="Export all courses",
+           response_class=StreamingResponse,
+           responses={
+               200: {
+                   "description": "Every matching course, ordered by id",
+                   "content": {
+                       "application/x-ndjson": {"schema": {"type": "string", "description": "One Course JSON object per line"}},
+                       "text/csv": {"schema": {"type": "string", "description": "Header row, then one course per row"}}
+                   }
+               }
+           })
+async def export_items(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Output format"),
+    name: Optional[str] = Query(None, description="Only courses whose name contains this text (case-insensitive)"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price (inclusive)"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price (inclusive)"),
+    db=Depends(get_db),
+):
+    """
+    Stream every course (or every course matching the filters) as NDJSON
+    or CSV.
+    
+    Rows are read from the database through a server-side cursor and
+    written out batch by batch, so the export starts immediately and
+    memory use does not grow with the size of the table. Exports bypass
+    the response cache.
+    """
+    exempt_row_budget()
+    batches = db.iter_data("items", filter_condition(name, min_price, max_price))
+    if format == "csv":
+        # Sent up front so an empty export is still a valid CSV file.
+        header = encode_export_batch([], format, header=True)
+    else:
+        header = b""
+    
+    # The sync generator is iterated on the threadpool by StreamingResponse.
+    if inspect.isasyncgen(batches):
+        async def body():
+            yield header
+            async for rows in batches:
+                yield encode_export_batch(rows, format)
+    else:
+        def body():
+            yield header
+            for rows in batches:
+                yield encode_export_batch(rows, format)
+    
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="items.{format}"'},
+    )
+
+@router.get("/items/stats", response_model=CourseStats, summary="Course statistics")
+async def read_item_stats(
+    name: Optional[str] = Query(None, description="Only courses whose name contains this text (case-insensitive)"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price (inclusive)"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price (inclusive)"),
+    db=Depends(get_db),
+):
+    """
+    Count the courses (or the courses matching the filters) and summarize
+    their prices, in one aggregate query instead of downloading the list.
+    
+    The summary is kept in the response cache until the next write, so
+    dashboards polling it do not re-run the aggregate on every request.
+    """
+    condition = filter_condition(name, min_price, max_price)
+    try:
+        key = await cache.list_key("items", stats="price", **condition)
+        stats = await cache.get_or_load(key, lambda: call_db(db.column_stats, "items", "price", condition))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return CourseStats(
+        count=stats["count"], min_price=stats["min"], max_price=stats["max"],
+        avg_price=stats["avg"], total_price=stats["sum"],
+    )
+
+@router.get("/items/search", response_model=SearchResults, summary="Search courses",
+           responses={400: {"description": "Empty search query"}})
+async def search_items(
+    q: str = Query(..., min_length=1, max_length=200,
+                   description='Search text: words, "quoted phrases", `or`, and `-excluded` words'),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT, description="Maximum number of results"),
+    db=Depends(get_db),
+):
+    """
+    Find courses by keyword in their name and description, best match
+    first.
+    
+    On PostgreSQL this is full-text search (stemmed, with name matches
+    ranked above description matches) on an indexed search column, topped
+    up with trigram matches so that prefixes and misspellings such as
+    `pyth` or `pyhton` still find courses. Results are cached until the
+    next write.
+    """
+    query = q.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    
+    try:
+        key = await cache.list_key("items", search=query, limit=limit)
+        results = await cache.get_or_load(key, lambda: call_db(db.search, "items", query, limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return SearchResults(query=query, items=results)
+
+def sse_event(token, change):
+    event = "reset" if change["op"] == "reset" else "change"
+    return f"id: {token}\nevent: {event}\ndata: {json.dumps(change, separators=(',', ':'))}\n\n"
+
+@router.get("/items/changes", summary="Stream course changes", response_class=StreamingResponse,
+           responses={200: {"content": {"text/event-stream": {}},
+                            "description": "Server-Sent Events: `change` and `reset` events"}})
+async def stream_changes(
+    resume: Optional[str] = Query(None, description="Resume token: the `id` of the last event received"),
+    last_event_id: Optional[str] = Header(None, description="Sent by EventSource when it reconnects"),
+):
+    """
+    Stream course changes as Server-Sent Events, instead of polling the
+    list. Each `change` event carries JSON
+    `{"op": "insert"|"update"|"delete", "id": ..., "row": {...}}`; `row`
+    is the course as stored, missing for deletes (and for courses too
+    large for a notification, which should be fetched by id).
+    
+    Every event's `id` is a resume token. Reconnect with it (EventSource
+    does this by itself via `Last-Event-ID`, or pass `resume`) to receive
+    the changes missed in between. A `reset` event means they can't be
+    replayed (a different worker, a restart, or too long ago) or a bulk
+    write changed many courses: reload the list, then carry on.
+    
+    A client that falls too far behind is disconnected and resumes from
+    its last token, so slow clients never hold up the others.
+    """
+    async def stream():
+        subscription, backlog = changes.subscribe(last_event_id or resume)
+        try:
+            yield f"retry: {CHANGES_RETRY_MS}\n\n"
+            async for event in changes.events(subscription, backlog, CHANGES_KEEPALIVE):
+                # Idle streams get a comment, so proxies keep them open
+                # and closed connections are noticed.
+                yield ": keepalive\n\n" if event is None else sse_event(*event)
+        finally:
+            changes.unsubscribe(subscription)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/items/changes/ws")
+async def stream_changes_ws(websocket: WebSocket, resume: Optional[str] = None):
+    """
+    The change stream over a WebSocket: one JSON message per event, the
+    change with its resume token as `token`. Closed with 1013 (try again)
+    when the client falls behind; reconnect with `?resume=<token>`.
+    """
+    await websocket.accept()
+    subscription, backlog = changes.subscribe(resume)
+    try:
+        async for event in changes.events(subscription, backlog, CHANGES_KEEPALIVE):
+            if event is not None:
+                token, change = event
+                await websocket.send_json({"token": token, **change})
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        changes.unsubscribe(subscription)
+
+@router.get("/items/{item_id}", response_model=Course,
+           responses={**CONDITIONAL_RESPONSES, 404: {"description": "Course not found"}})
+async def read_item(
+    item_id: int,
+    response: Response,
+    db=Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    summary="Get a course",
+    description="Retrieve a single course by ID"
+):
+    """
+    Retrieve a single course by its ID.
+    
+    - **item_id**: The ID of the course to fetch
     
+    The response carries an `ETag`; send it in `If-None-Match` to get
+    `304 Not Modified` while the course is unchanged, or in `If-Match` on
+    PUT/DELETE to make the write conditional.
+    """
     try:
-        courses = db.fetch_data("items")
-        return courses
+        course = await cache.get_or_load(
+            cache.row_key("items", item_id), lambda: call_db(db.fetch_one, "items", item_id)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    etag = make_etag(course)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    if fast_json.FAST_JSON:
+        return fast_json.json_response(course, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return course
 
-@router.put("/items/{item_id}", response_model=CourseResponse)
-def update_item(
+@router.put("/items/{item_id}", response_model=CourseResponse,
+           responses={**PRECONDITION_RESPONSES, 201: {"description": "Course created (full body, no `If-Match`)"}})
+async def update_item(
     item_id: int,
     item: CourseUpdate,
+    response: Response,
+    db=Depends(get_db),
+    if_match: Optional[str] = Header(None),
     summary="Update a course",
     description="Update an existing course by ID"
 ):
@@ -228,10 +844,15 @@ def update_item(
     - **name**: New course name (optional)
     - **description**: New course description (optional)
     - **price**: New course price (optional, must be greater than 0)
-    """
-    if db is None:
-        raise HTTPException(status_code=503, detail="Database connection not available")
     
+    Send the course's `ETag` in `If-Match` to update only if nobody has
+    changed it since you read it (otherwise `412`).
+    
+    A body with every field (name, description and price) and no
+    `If-Match` is an upsert: if the course does not exist it is created
+    with this id and `201` is returned, so sync jobs can PUT without
+    checking first. Partial bodies only update (`404` if missing).
+    """
     try:
         update_data = {}
         if item.name is not None:
@@ -244,15 +865,27 @@ def update_item(
         if not update_data:
             raise HTTPException(status_code=400, detail="No fields to update")
             
-        db.update_data("items", update_data, {"id": item_id})
-        
-        # Fetch updated course
-        updated_courses = db.fetch_data("items")
-        updated_course = next((c for c in updated_courses if c["id"] == item_id), None)
-        
-        if not updated_course:
+        condition = await check_if_match(db, item_id, if_match)
+        updated = await call_db(db.update_returning, "items", update_data, condition)
+        if updated:
+            await cache.invalidate_rows("items", item_id)
+            changes.publish_local({"op": "update", "id": item_id, "row": updated[0]})
+        elif if_match is None and None not in (item.name, item.description, item.price):
+            # Not there yet: insert it. ON CONFLICT turns a concurrent
+            # create of the same id into an update instead of an error.
+            created = (await call_db(db.upsert, "items", [{"id": item_id, **update_data}]))[0]
+            await cache.invalidate_rows("items", item_id)
+            changes.publish_local({"op": "insert", "id": item_id, "row": created})
+            response.status_code = 201
+            response.headers["ETag"] = make_etag(created)
+            return CourseResponse(message="Course created successfully!", course=Course(**created))
+        elif if_match is not None:
+            raise HTTPException(status_code=412, detail="Precondition failed: course has changed")
+        else:
             raise HTTPException(status_code=404, detail="Course not found")
             
+        updated_course = updated[0]
+        response.headers["ETag"] = make_etag(updated_course)
         course = Course(**updated_course)
         return CourseResponse(message="Course updated successfully!", course=course)
     except HTTPException:
@@ -261,9 +894,11 @@ def update_item(
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/items/{item_id}", response_model=MessageResponse)
-def delete_item(
+@router.delete("/items/{item_id}", response_model=MessageResponse, responses=PRECONDITION_RESPONSES)
+async def delete_item(
     item_id: int,
+    db=Depends(get_db),
+    if_match: Optional[str] = Header(None),
     summary="Delete a course",
     description="Delete a course by ID"
 ):
@@ -271,12 +906,28 @@ def delete_item(
     Delete a course from the database.
     
     - **item_id**: The ID of the course to delete
-    """
-    if db is None:
-        raise HTTPException(status_code=503, detail="Database connection not available")
     
+    Send the course's `ETag` in `If-Match` to delete only if it is
+    unchanged since you read it (otherwise `412`).
+    """
     try:
-        db.delete_data("items", {"id": item_id})
+        condition = await check_if_match(db, item_id, if_match)
+        if await call_db(db.delete_data, "items", condition):
+            await cache.invalidate_rows("items", item_id)
+            changes.publish_local({"op": "delete", "id": item_id})
+        elif if_match is not None:
+            raise HTTPException(status_code=412, detail="Precondition failed: course has changed")
         return MessageResponse(message="Course deleted successfully!")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/db/pool", tags=["database"], summary="Connection pool statistics")
+async def read_pool_stats(db=Depends(get_db)):
+    """
+    Report connection pool usage for this worker: connections checked in
+    and out, overflow in use, pool timeouts, and a histogram of how long
+    requests waited to get a connection.
+    """
+    return db.pool_stats()
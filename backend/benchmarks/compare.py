@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmarks.load result files and flag regressions.
+
+A regression is a latency percentile that grew, or a throughput that
+dropped, by more than --threshold percent. Exits with status 1 when any
+endpoint regressed, so it can gate CI.
+Usage: python -m benchmarks.compare BASELINE.json CURRENT.json [--threshold 10]
+"""
+
+import argparse
+import json
+import sys
+
+# Metric name -> True when higher is better.
+METRICS = {"rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+
+
+def compare(baseline, current, threshold):
+    """Yield (endpoint, metric, old, new, change_pct, regressed) for each shared metric."""
+    for endpoint, new_result in current["results"].items():
+        old_result = baseline["results"].get(endpoint)
+        if old_result is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = old_result.get(metric), new_result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            regressed = -change > threshold if higher_is_better else change > threshold
+            yield endpoint, metric, old, new, change, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load test results")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent (default 10)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    print(f"{baseline['meta'].get('commit')} -> {current['meta'].get('commit')} (threshold {args.threshold:g}%)")
+    regressions = 0
+    for endpoint, metric, old, new, change, regressed in compare(baseline, current, args.threshold):
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {endpoint:<8}{metric:<8}{old:>10}{new:>10}{change:>+9.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Load test for the CRUD endpoints.
+
+Seeds --rows courses, then drives each endpoint in turn (create, read,
+list, update, delete) with --concurrency concurrent async clients and
+reports p50/p95/p99 latency and requests/sec per endpoint. Results are
+written as JSON, to be diffed between commits with benchmarks.compare.
+
+By default a uvicorn server is started against a fresh SQLite database
+(a stand-in: SQLite serializes writes, so write latencies are pessimistic).
+Pass --database-url to start it against PostgreSQL, or --base-url to load
+an already running server. The spawned server inherits the environment,
+so e.g. CACHE_BACKEND=none or DB_ASYNC=true apply to it.
+
+Usage: python -m benchmarks.load [--rows N] [--requests N] [--concurrency N]
+       [--database-url URL | --base-url URL] [--output results.json]
+Requires httpx (pip install ".[bench]").
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from sqlalchemy.engine import make_url
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SEED_CHUNK = 10_000
+ENDPOINTS = ("create", "read", "list", "update", "delete")
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1) if elapsed else None,
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1]) if latencies else None,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_server(database_url):
+    """Run `uvicorn main:app` against database_url until the block exits."""
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health/ready").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("Benchmark server did not start")
+            time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def course(course_id):
+    return {
+        "id": course_id,
+        "name": f"Benchmark course {course_id}",
+        "description": "Seeded by benchmarks.load",
+        "price": round(random.uniform(5, 500), 2),
+    }
+
+
+async def seed(client, rows):
+    # Seeded through the NDJSON bulk endpoint, in chunks, so this works
+    # against any server; duplicate ids from an earlier run are skipped.
+    for start in range(1, rows + 1, SEED_CHUNK):
+        ids = range(start, min(start + SEED_CHUNK, rows + 1))
+        body = "\n".join(json.dumps(course(i)) for i in ids)
+        resp = await client.post("/api/v1/items/bulk", content=body,
+                                 headers={"Content-Type": "application/x-ndjson"}, timeout=300)
+        resp.raise_for_status()
+
+
+async def run_phase(client, make_request, count, concurrency):
+    """Send `count` requests from `concurrency` workers; returns the summary."""
+    latencies, errors = [], 0
+    issued = 0
+
+    async def worker():
+        nonlocal issued, errors
+        while issued < count:
+            n = issued
+            issued += 1
+            method, url, body = make_request(n)
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, url, json=body)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(base_url, rows, requests, concurrency, page_size):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await seed(client, rows)
+        # Created ids start above the seeded range; delete removes them again.
+        first_new = rows + 1
+        phases = {
+            "create": lambda n: ("POST", "/api/v1/items/", course(first_new + n)),
+            "read": lambda n: ("GET", f"/api/v1/items/{random.randint(1, rows)}", None),
+            "list": lambda n: ("GET", f"/api/v1/items/?limit={page_size}&after={random.randint(0, max(rows - page_size, 0))}", None),
+            "update": lambda n: ("PUT", f"/api/v1/items/{random.randint(1, rows)}", {"price": round(random.uniform(5, 500), 2)}),
+            "delete": lambda n: ("DELETE", f"/api/v1/items/{first_new + n}", None),
+        }
+        results = {}
+        for name in ENDPOINTS:
+            results[name] = await run_phase(client, phases[name], requests, concurrency)
+            print(format_row(name, results[name]))
+        return results
+
+
+def format_row(name, result):
+    cells = [f"{result[key]:>9}" if result[key] is not None else f"{'-':>9}"
+             for key in ("rps", "p50_ms", "p95_ms", "p99_ms")]
+    return f"  {name:<8}{''.join(cells)}   ({result['errors']} errors)"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the CRUD endpoints")
+    parser.add_argument("--rows", type=int, default=10_000, help="courses to seed (default 10000)")
+    parser.add_argument("--requests", type=int, default=2_000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--page-size", type=int, default=100, help="limit used by the list phase")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--database-url", help="start a local server against this database")
+    target.add_argument("--base-url", help="load an already running server instead")
+    parser.add_argument("--output", help="JSON results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, for repeatable request mixes")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    database_url = args.database_url
+    target_name = args.base_url or make_url(database_url or "sqlite://").get_backend_name()
+    print(f"{args.rows} rows, {args.requests} requests/endpoint, concurrency {args.concurrency}, {target_name}")
+    print(f"  {'endpoint':<8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    load = lambda base_url: asyncio.run(run(base_url, args.rows, args.requests, args.concurrency, args.page_size))
+    if args.base_url:
+        results = load(args.base_url)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            with local_server(database_url or f"sqlite:///{Path(tmp) / 'bench.db'}") as base_url:
+                results = load(base_url)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "target": target_name,
+            "rows": args.rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "page_size": args.page_size,
+            "python": platform.python_version(),
+            "env": {name: os.environ[name] for name in ("DB_ASYNC", "CACHE_BACKEND", "FAST_JSON") if name in os.environ},
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else BACKEND_DIR / "benchmarks" / "results" / f"{commit or 'latest'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Compare the cost of serializing a list page through Pydantic models
+(what FastAPI does with response_model=CoursePage) against the FAST_JSON
+path, which encodes the rows as they come back from the database.
+Usage: python -m benchmarks.serialization [--rows N] [--repeat N]
+"""
+
+import argparse
+import json
+import time
+from api.fast_json import encode_json, orjson
+from api.models import CoursePage
+
+
+def make_rows(count):
+    return [
+        {"id": i, "name": f"Course {i}", "description": "Learn Python from basics to advanced", "price": 9.99 + i}
+        for i in range(1, count + 1)
+    ]
+
+
+def model_path(rows):
+    # Validate into models, dump back to Python, then encode, like FastAPI's serialize_response.
+    page = CoursePage(items=rows, next_cursor=None)
+    return json.dumps(page.model_dump(mode="json")).encode()
+
+
+def model_json_path(rows):
+    # Same models, but encoded by pydantic-core straight to bytes.
+    return CoursePage(items=rows, next_cursor=None).model_dump_json().encode()
+
+
+def fast_path(rows):
+    return encode_json({"items": rows, "next_cursor": None})
+
+
+def best_of(func, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="rows per page")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per path (best is reported)")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    # All paths must produce the same document.
+    assert CoursePage.model_validate_json(fast_path(rows)) == CoursePage.model_validate_json(model_path(rows))
+
+    encoder = "orjson" if orjson is not None else "pydantic-core"
+    print(f"{args.rows} rows, best of {args.repeat} (fast path encoder: {encoder})")
+    baseline = None
+    for label, func in (
+        ("pydantic models + json.dumps", model_path),
+        ("pydantic models + model_dump_json", model_json_path),
+        ("FAST_JSON", fast_path),
+    ):
+        seconds = best_of(func, rows, args.repeat)
+        baseline = baseline or seconds
+        per_row_us = seconds / args.rows * 1e6
+        print(f"  {label:<36} {seconds * 1e3:8.2f} ms  {per_row_us:6.2f} µs/row  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
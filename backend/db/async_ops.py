@@ -0,0 +1,334 @@
+from sqlalchemy import func, inspect, select, text, Table
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from contextlib import asynccontextmanager
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from db.pool import PoolMonitor, pool_options_from_env
+from db.ops import (
+    BULK_BATCH_SIZE, IDEMPOTENCY_TABLE, STREAM_BATCH_SIZE, IdempotencyKeyReused, TableRegistry,
+    advance_identity, build_database_url, build_where, condition_key, delete_stmt, dialect_insert, ensure_schema, fulltext_search_stmt, group_by_columns,
+    group_row_updates, max_key,
+    like_search_stmt, row_dicts, schema_current, select_stmt, sorted_select_stmt, split_page,
+    stats_stmt, trigram_available, trigram_search_stmt, update_many_stmt, update_stmt,
+)
+from db.schema import SEARCHABLE
+
+# Async driver used for each sync dialect.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    if url.drivername in ASYNC_DRIVERS.values():
+        return url
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncSQLAlchemyOps(TableRegistry):
+    """
+    asyncio counterpart of SQLAlchemyOps with the same methods as
+    coroutines, so a single worker can keep many queries in flight without
+    tying up threadpool slots. Needs asyncpg (PostgreSQL) or aiosqlite.
+    """
+
+    def __init__(self, database_url=None):
+        load_dotenv()
+
+        url = to_async_url(build_database_url(database_url))
+        pool_options = pool_options_from_env()
+
+        try:
+            self.engine = create_async_engine(url, **pool_options)
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to database: {e}")
+
+        self.pool_monitor = PoolMonitor(self.engine.sync_engine)
+        self._init_table_registry()
+
+    @asynccontextmanager
+    async def _connect(self):
+        start = time.perf_counter()
+        conn = self.engine.connect()
+        try:
+            await conn.start()
+        except PoolTimeoutError:
+            self.pool_monitor.record_timeout()
+            raise
+        self.pool_monitor.observe_wait(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    @asynccontextmanager
+    async def _begin(self):
+        async with self._connect() as conn, conn.begin():
+            yield conn
+
+    def pool_stats(self):
+        return self.pool_monitor.snapshot()
+
+    async def ping(self):
+        async with self._connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def get_table(self, table_name):
+        table = self._cached_table(table_name)
+        if table is not None:
+            return table
+        self.table_cache_misses += 1
+        table = self._declared_table(table_name)
+        if table is None:
+            async with self._connect() as conn:
+                table = await conn.run_sync(
+                    lambda sync_conn: Table(table_name, self.metadata, autoload_with=sync_conn)
+                )
+        self._tables[table_name] = table
+        return table
+
+    async def ensure_table(self, table_name):
+        async with self._connect() as conn:
+            current = await conn.run_sync(
+                lambda sync_conn: schema_current(inspect(sync_conn), table_name)
+            )
+        if current:
+            return False
+        async with self._begin() as conn:
+            changed = await conn.run_sync(ensure_schema, table_name)
+        self.invalidate_table(table_name)
+        return changed
+
+    async def insert_data(self, table_name, data):
+        statements = self._table_statements(await self.get_table(table_name))
+        params = statements.row_params(data)
+        async with self._connect() as conn:
+            if params.get(statements.key) is not None:
+                async with conn.begin():
+                    await conn.run_sync(advance_identity, statements.table, statements.key, params[statements.key])
+            async with conn.begin():
+                await conn.execute(statements.insert, params)
+
+    async def insert_returning(self, table_name, row, key="id"):
+        # Same contract as SQLAlchemyOps.insert_returning.
+        statements = self._table_statements(await self.get_table(table_name), key)
+        async with self._connect() as conn:
+            if row.get(key) is not None:
+                async with conn.begin():
+                    await conn.run_sync(advance_identity, statements.table, key, row[key])
+            async with conn.begin():
+                return row_dicts(await conn.execute(statements.insert_returning, row))[0]
+
+    async def bulk_insert(self, table_name, rows, batch_size=None):
+        # Same contract as SQLAlchemyOps.bulk_insert, without the COPY path.
+        if not rows:
+            return 0, []
+        table = await self.get_table(table_name)
+        batch_size = batch_size or BULK_BATCH_SIZE
+        inserted, errors = 0, []
+        top = max_key(rows)
+        async with self._connect() as conn:
+            if top is not None:
+                async with conn.begin():
+                    await conn.run_sync(advance_identity, table, "id", top)
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                for offsets in group_by_columns(batch):
+                    try:
+                        async with conn.begin():
+                            await conn.execute(table.insert(), [batch[offset] for offset in offsets])
+                        inserted += len(offsets)
+                        continue
+                    except SQLAlchemyError:
+                        pass
+                    for offset in offsets:
+                        try:
+                            async with conn.begin():
+                                await conn.execute(table.insert(), batch[offset])
+                            inserted += 1
+                        except SQLAlchemyError as e:
+                            errors.append((start + offset, str(getattr(e, "orig", None) or e)))
+        return inserted, errors
+
+    async def fetch_data(self, table_name, condition=None, limit=None, after=None, key="id"):
+        table = await self.get_table(table_name)
+        stmt = select_stmt(table, condition, limit, after, key)
+        async with self._connect() as conn:
+            result = await conn.execute(stmt)
+            return row_dicts(result)
+
+    async def iter_data(self, table_name, condition=None, key="id", batch_size=None):
+        # Async generator with the same contract as SQLAlchemyOps.iter_data.
+        table = await self.get_table(table_name)
+        stmt = select_stmt(table, condition).order_by(getattr(table.c, key))
+        async with self._connect() as conn:
+            result = await conn.stream(stmt.execution_options(yield_per=batch_size or STREAM_BATCH_SIZE))
+            async for partition in result.partitions():
+                yield row_dicts(partition)
+
+    async def fetch_page(self, table_name, limit, after=None, condition=None, key="id", sort=None, descending=False):
+        if sort is not None and (sort != key or descending):
+            table = await self.get_table(table_name)
+            stmt = sorted_select_stmt(table, condition, limit + 1, sort, descending, after, key)
+            async with self._connect() as conn:
+                rows = row_dicts(await conn.execute(stmt))
+            return split_page(rows, limit, key, sort)
+        if condition:
+            rows = await self.fetch_data(table_name, condition, limit=limit + 1, after=after, key=key)
+        else:
+            stmt, params = self._table_statements(await self.get_table(table_name), key).page(limit + 1, after)
+            async with self._connect() as conn:
+                rows = row_dicts(await conn.execute(stmt, params))
+        return split_page(rows, limit, key)
+
+    async def column_stats(self, table_name, column_name, condition=None):
+        stmt = stats_stmt(await self.get_table(table_name), column_name, condition)
+        async with self._connect() as conn:
+            return dict((await conn.execute(stmt)).one()._mapping)
+
+    async def fetch_one(self, table_name, key_value, key="id"):
+        statements = self._table_statements(await self.get_table(table_name), key)
+        async with self._connect() as conn:
+            row = (await conn.execute(statements.get, {"_key": key_value})).first()
+            return row_dicts([row])[0] if row is not None else None
+
+    async def search(self, table_name, query, limit=20, key="id"):
+        # Same contract as SQLAlchemyOps.search.
+        table = await self.get_table(table_name)
+        spec = SEARCHABLE[table_name]
+        async with self._connect() as conn:
+            if conn.dialect.name != "postgresql":
+                return row_dicts(await conn.execute(like_search_stmt(table, query, limit, spec["weights"], key)))
+            rows = row_dicts(await conn.execute(fulltext_search_stmt(table, query, limit, key)))
+            if len(rows) < limit and spec["trigram"] and await conn.run_sync(trigram_available):
+                found = [row[key] for row in rows]
+                stmt = trigram_search_stmt(table, query, limit - len(rows), spec["trigram"], found, key)
+                rows += row_dicts(await conn.execute(stmt))
+            return rows
+
+    async def update_data(self, table_name, set_values, condition):
+        table = await self.get_table(table_name)
+        async with self._begin() as conn:
+            return (await conn.execute(update_stmt(table, set_values, condition))).rowcount
+
+    async def update_returning(self, table_name, set_values, condition):
+        table = await self.get_table(table_name)
+        key = condition_key(condition)
+        if key is not None and self.engine.dialect.update_returning:
+            statements = self._table_statements(table)
+            async with self._begin() as conn:
+                return row_dicts(await conn.execute(statements.update_returning, {"_key": key, **set_values}))
+        stmt = update_stmt(table, set_values, condition)
+        async with self._begin() as conn:
+            if self.engine.dialect.update_returning:
+                result = await conn.execute(stmt.returning(*table.c))
+                return row_dicts(result)
+            if (await conn.execute(stmt)).rowcount == 0:
+                return []
+            result = await conn.execute(select_stmt(table, condition))
+            return row_dicts(result)
+
+    async def update_where(self, table_name, set_values, condition, key="id"):
+        table = await self.get_table(table_name)
+        stmt = update_stmt(table, set_values, condition)
+        key_col = getattr(table.c, key)
+        async with self._begin() as conn:
+            if self.engine.dialect.update_returning:
+                return list((await conn.execute(stmt.returning(key_col))).scalars())
+            keys = select(key_col).where(build_where(table, condition)).with_for_update()
+            keys = list((await conn.execute(keys)).scalars())
+            await conn.execute(stmt)
+            return keys
+
+    async def update_many(self, table_name, rows, key="id"):
+        table = await self.get_table(table_name)
+        stmt = update_many_stmt(table, key)
+        groups = group_row_updates(rows, key)
+        async with self._begin() as conn:
+            if not self.engine.dialect.supports_sane_multi_rowcount:
+                keys = {params["_key"] for group in groups for params in group}
+                count = select(func.count()).select_from(table).where(getattr(table.c, key).in_(keys))
+                updated = (await conn.execute(count)).scalar()
+                for params in groups:
+                    await conn.execute(stmt, params)
+                return updated
+            updated = 0
+            for params in groups:
+                updated += (await conn.execute(stmt, params)).rowcount
+            return updated
+
+    async def upsert(self, table_name, rows, key="id"):
+        # Same contract as SQLAlchemyOps.upsert.
+        rows = list({row[key]: row for row in rows}.values())
+        if not rows:
+            return []
+        table = await self.get_table(table_name)
+        stmt = self._table_statements(table, key).upsert(self.engine.dialect.name)
+        stored = []
+        async with self._connect() as conn:
+            async with conn.begin():
+                await conn.run_sync(advance_identity, table, key, max_key(rows, key))
+            async with conn.begin():
+                for start in range(0, len(rows), BULK_BATCH_SIZE):
+                    stored += row_dicts(await conn.execute(stmt, rows[start:start + BULK_BATCH_SIZE]))
+        return stored
+
+    async def insert_idempotent(self, table_name, row, idempotency_key, fingerprint):
+        # Same contract as SQLAlchemyOps.insert_idempotent.
+        statements = self._table_statements(await self.get_table(table_name))
+        keys = await self.get_table(IDEMPOTENCY_TABLE)
+        claim = dialect_insert(keys, self.engine.dialect.name).on_conflict_do_nothing().returning(keys.c.key)
+        async with self._connect() as conn:
+            if row.get(statements.key) is not None:
+                async with conn.begin():
+                    await conn.run_sync(advance_identity, statements.table, statements.key, row[statements.key])
+            async with conn.begin():
+                if (await conn.execute(claim, {"key": idempotency_key, "fingerprint": fingerprint})).first() is None:
+                    stored = (await conn.execute(select(keys).where(keys.c.key == idempotency_key))).one()
+                    if stored.fingerprint != fingerprint:
+                        raise IdempotencyKeyReused(f"Idempotency key {idempotency_key!r} was used for a different request")
+                    return json.loads(stored.response), True
+                created = row_dicts(await conn.execute(statements.insert_returning, row))[0]
+                await conn.execute(keys.update().where(keys.c.key == idempotency_key).values(response=json.dumps(created)))
+                return created, False
+
+    async def purge_idempotency_keys(self, max_age_seconds):
+        keys = await self.get_table(IDEMPOTENCY_TABLE)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        async with self._begin() as conn:
+            return (await conn.execute(keys.delete().where(keys.c.created_at < cutoff))).rowcount
+
+    async def delete_data(self, table_name, condition):
+        table = await self.get_table(table_name)
+        key = condition_key(condition)
+        if key is not None:
+            stmt, params = self._table_statements(table).delete, {"_key": key}
+        else:
+            stmt, params = delete_stmt(table, condition), None
+        async with self._begin() as conn:
+            return (await conn.execute(stmt, params)).rowcount
+
+    async def delete_where(self, table_name, condition, key="id"):
+        table = await self.get_table(table_name)
+        stmt = delete_stmt(table, condition)
+        key_col = getattr(table.c, key)
+        async with self._begin() as conn:
+            if self.engine.dialect.delete_returning:
+                return list((await conn.execute(stmt.returning(key_col))).scalars())
+            keys = select(key_col).where(build_where(table, condition)).with_for_update()
+            keys = list((await conn.execute(keys)).scalars())
+            await conn.execute(stmt)
+            return keys
+
+    async def close_connection(self):
+        await self.engine.dispose()
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Returned by backends on a miss, since None is a valid cached value.
+MISSING = object()
+
+
+class NullCache:
+    """Backend that stores nothing (CACHE_BACKEND=none)."""
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def add(self, key, value):
+        return True
+
+    def delete(self, *keys):
+        pass
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL. Thread-safe."""
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value):
+        # Store without expiry unless the key is already present.
+        with self._lock:
+            if key in self._entries:
+                return False
+            self._entries[key] = (value, None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisCache:
+    """
+    Backend for any Redis-protocol server. Values are stored as JSON.
+    `client` can be anything with redis-py's get/set/delete methods, which
+    lets tests pass a local stand-in.
+    """
+
+    # Calls wait on the network: ReadThroughCache runs them off the event loop.
+    blocking = True
+
+    def __init__(self, client=None, url=None, ttl=30, prefix="crud-api:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("CACHE_BACKEND=redis requires the 'redis' package")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return MISSING if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def add(self, key, value):
+        return bool(self.client.set(self.prefix + key, json.dumps(value), nx=True))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+class ReadThroughCache:
+    """
+    Read-through cache for table reads.
+
+    Single rows are cached under their key; list results under a per-table
+    generation token, so one write invalidates every cached page of that
+    table without having to track which pages held the row. Concurrent
+    misses for the same key share one load, so an expiry never turns into
+    a burst of identical queries. Coalescing is per process.
+
+    Backends that block on the network (Redis) are called in a worker
+    thread so they never stall the event loop, with each step's calls
+    grouped into one hop; in-process backends are called directly.
+
+    A load that overlaps a write to its table is returned but not stored:
+    it may have read the row before the write committed, and storing it
+    after the write's invalidation would keep the old value until expiry.
+    Keys therefore start with their table name.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def _call(self, func, *args):
+        if getattr(self.backend, "blocking", False):
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _generation(self, table_name):
+        # A random token rather than a counter: if the token is ever lost
+        # (eviction, restart) the replacement can't collide with old keys.
+        key = self._generation_key(table_name)
+        token = self.backend.get(key)
+        if token is MISSING:
+            token = uuid.uuid4().hex
+            if not self.backend.add(key, token):
+                token = self.backend.get(key)
+        return token
+
+    def _generation_key(self, table_name):
+        return f"{table_name}:gen"
+
+    async def generation(self, table_name):
+        return await self._call(self._generation, table_name)
+
+    async def list_key(self, table_name, **params):
+        encoded = json.dumps(params, sort_keys=True, default=str)
+        return f"{table_name}:list:{await self.generation(table_name)}:{encoded}"
+
+    def row_key(self, table_name, key_value):
+        return f"{table_name}:row:{key_value}"
+
+    def _lookup(self, key, generation_key):
+        # The cached value, and the table generation a load would start from.
+        value = self.backend.get(key)
+        return value, (self.backend.get(generation_key) if value is MISSING else None)
+
+    def _store(self, key, value, generation_key, generation):
+        # Every invalidation replaces the table's generation token.
+        if self.backend.get(generation_key) == generation:
+            self.backend.set(key, value)
+
+    async def get_or_load(self, key, loader):
+        generation_key = self._generation_key(key.partition(":")[0])
+        value, generation = await self._call(self._lookup, key, generation_key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            value = await loader()
+            if value is not None:
+                await self._call(self._store, key, value, generation_key, generation)
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            pending.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def _invalidate(self, table_name, key_values):
+        if key_values:
+            self.backend.delete(*(self.row_key(table_name, value) for value in key_values))
+        self.backend.set(self._generation_key(table_name), uuid.uuid4().hex, ttl=0)
+
+    async def invalidate_lists(self, table_name):
+        await self._call(self._invalidate, table_name, ())
+
+    async def invalidate_rows(self, table_name, *key_values):
+        await self._call(self._invalidate, table_name, key_values)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+
+def cache_from_env():
+    """
+    Build the read-through cache from CACHE_BACKEND (memory, redis or none),
+    CACHE_TTL (seconds), CACHE_MAX_ENTRIES and REDIS_URL.
+
+    The memory backend is refused when WEB_CONCURRENCY runs several workers:
+    each would keep its own copy and miss the others' invalidations, serving
+    stale reads for up to CACHE_TTL. Share the cache through Redis instead.
+    """
+    backend_name = os.getenv("CACHE_BACKEND", "memory").lower()
+    workers = int(os.getenv("WEB_CONCURRENCY") or 1)
+    if backend_name == "memory" and workers > 1:
+        raise ValueError(f"CACHE_BACKEND=memory is per process and {workers} workers would serve "
+                         f"each other's stale reads; use CACHE_BACKEND=redis (or none)")
+    ttl = float(os.getenv("CACHE_TTL", "30"))
+    if backend_name == "none":
+        backend = NullCache()
+    elif backend_name == "redis":
+        backend = RedisCache(url=os.getenv("REDIS_URL"), ttl=int(ttl))
+    elif backend_name == "memory":
+        backend = LRUCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")), ttl=ttl)
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {backend_name}")
+    return ReadThroughCache(backend)
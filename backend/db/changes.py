@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import select
+import threading
+from collections import deque
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from db.ops import build_database_url
+from db.pool import dedicated_connections
+
+logger = logging.getLogger(__name__)
+
+# Sent instead of the missed changes when a subscriber cannot be caught up
+# (unknown or expired resume token, or notifications lost while the LISTEN
+# connection was down): the client should reload what it shows.
+RESET = {"op": "reset"}
+
+
+class Subscription:
+    """One consumer of a ChangeFeed, with its own bounded queue."""
+
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Set when the consumer fell behind by a full queue; its stream ends
+        # once the queue is drained and the client resumes from its token.
+        self.overflowed = False
+
+
+class ChangeFeed:
+    """
+    Fans out table changes to many subscribers within one worker.
+
+    Every change gets a sequence number and is kept in a ring buffer of the
+    last `buffer_size` changes. A change's resume token is "epoch:seq",
+    where the epoch is random per feed, so a token from another worker or
+    from before a restart is never mistaken for one of ours. Subscribing
+    with a token replays the buffered changes after it, or starts with a
+    reset when they are gone.
+
+    Each subscriber has a queue of `queue_size` changes. Publishing never
+    waits: a subscriber whose queue is full is dropped (its stream ends
+    after what it has queued) and is expected to reconnect with its last
+    token. A slow client therefore costs at most one queue of memory and
+    never holds up the others.
+
+    Only used from the event loop; the LISTEN thread hands notifications
+    over with call_soon_threadsafe.
+    """
+
+    def __init__(self, buffer_size=1000, queue_size=100):
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.buffer = deque(maxlen=buffer_size)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.closed = False
+        self.listener = None
+        self.overflows = 0
+
+    def token(self, seq):
+        return f"{self.epoch}:{seq}"
+
+    def publish(self, change):
+        self.seq += 1
+        event = (self.token(self.seq), change)
+        self.buffer.append((self.seq, event))
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.subscribers.discard(subscription)
+                self.overflows += 1
+
+    def publish_local(self, change):
+        """
+        Publish a change made by this worker. Ignored while the feed is
+        fed by NOTIFY, which already reports every write, from all workers.
+        """
+        if self.listener is None:
+            self.publish(change)
+
+    def _missed(self, token):
+        # Buffered events after the token, or None if it can't be resumed.
+        epoch, _, seq = token.partition(":")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        seq = int(seq)
+        if seq < self.seq - len(self.buffer):
+            return None
+        return [event for event_seq, event in self.buffer if event_seq > seq]
+
+    def subscribe(self, token=None):
+        """
+        Register a subscriber; returns (subscription, events to send first).
+        Without a token only new changes are sent.
+        """
+        subscription = Subscription(self.queue_size)
+        backlog = []
+        if token:
+            backlog = self._missed(token)
+            if backlog is None:
+                backlog = [(self.token(self.seq), RESET)]
+        if self.closed:
+            subscription.overflowed = True
+        else:
+            self.subscribers.add(subscription)
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    async def events(self, subscription, backlog=(), keepalive=15.0):
+        """
+        Yield (token, change) pairs for a subscription, starting with its
+        backlog, and None after `keepalive` idle seconds. Ends when the
+        subscriber overflowed or the feed is closed.
+        """
+        for event in backlog:
+            yield event
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                return
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def close(self):
+        # End every stream (e.g. at shutdown, so open connections don't
+        # hold up a graceful restart); clients resume on another worker.
+        self.closed = True
+        for subscription in self.subscribers:
+            subscription.overflowed = True
+            try:
+                # Wakes a waiting consumer, which reads it as a keepalive.
+                subscription.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+        self.subscribers.clear()
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers), "seq": self.seq, "overflows": self.overflows,
+                "source": "notify" if self.listener is not None else "local"}
+
+
+class NotifyListener:
+    """
+    The worker's one LISTEN connection (psycopg2), shared by all of its
+    subscribers. A daemon thread waits on the socket and hands each
+    notification's JSON payload to `deliver` on the event loop. A lost
+    connection is reopened with backoff; changes made meanwhile can't be
+    recovered, so a reset is delivered once it is back.
+    """
+
+    def __init__(self, database_url, channel, deliver, retry_initial=0.5, retry_max=30.0, poll_interval=1.0):
+        self.engine = create_engine(database_url, poolclass=NullPool)
+        self.channel = channel
+        self.deliver = deliver
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.connected = False
+        self._lost = False
+        self._loop = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, loop):
+        self._loop = loop
+        self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+        self.engine.dispose()
+
+    def _hand_over(self, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed notification on %s: %r", self.channel, payload)
+            return
+        self._loop.call_soon_threadsafe(self.deliver, change)
+
+    def _listen(self):
+        raw = self.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            if self._lost:
+                # Reconnected: whatever was written in between is lost.
+                self._loop.call_soon_threadsafe(self.deliver, RESET)
+                self._lost = False
+            self.connected = True
+            logger.info("Listening for changes on %s", self.channel)
+            while not self._stopping.is_set():
+                # The timeout only bounds how long stop() waits.
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._hand_over(conn.notifies.pop(0).payload)
+        finally:
+            raw.close()
+
+    def _run(self):
+        delay = self.retry_initial
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                if self.connected:
+                    logger.warning("Lost the LISTEN connection on %s: %s", self.channel, e)
+                    self.connected, self._lost, delay = False, True, self.retry_initial
+                else:
+                    logger.warning("LISTEN on %s failed (retrying in %.1fs): %s", self.channel, delay, e)
+                self._stopping.wait(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.retry_max)
+
+
+def change_feed_from_env():
+    """
+    Build the feed from CHANGES_BUFFER_SIZE (changes kept for resuming,
+    default 1000) and CHANGES_QUEUE_SIZE (changes a subscriber may fall
+    behind, default 100).
+    """
+    return ChangeFeed(
+        buffer_size=int(os.getenv("CHANGES_BUFFER_SIZE", "1000")),
+        queue_size=int(os.getenv("CHANGES_QUEUE_SIZE", "100")),
+    )
+
+
+async def start_change_feed(feed, database_url, channel):
+    """
+    Feed `channel`'s notifications into the feed when the database is
+    PostgreSQL (with psycopg2). Elsewhere the feed stays local: it carries
+    only the writes published by this worker.
+    """
+    feed.closed = False
+    if not dedicated_connections():
+        logger.info("Change feed for %s is local to this worker (CHANGES_LISTEN=false)", channel)
+        return
+    try:
+        url = make_url(build_database_url(database_url))
+        if url.get_backend_name() != "postgresql" or url.get_driver_name() != "psycopg2":
+            logger.info("Change feed for %s is local to this worker (no LISTEN/NOTIFY on %s)",
+                        channel, url.get_backend_name())
+            return
+        listener = NotifyListener(
+            url, channel, feed.publish,
+            retry_initial=float(os.getenv("DB_RETRY_INITIAL", "0.5")),
+            retry_max=float(os.getenv("DB_RETRY_MAX", "30")),
+        )
+    except Exception as e:
+        logger.warning("Change feed for %s is local to this worker: %s", channel, e)
+        return
+    feed.listener = listener
+    listener.start(asyncio.get_running_loop())
+
+
+async def stop_change_feed(feed):
+    feed.close()
+    if feed.listener is not None:
+        await asyncio.to_thread(feed.listener.stop)
+        feed.listener = None
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, default
+from db.pool import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the query duration histogram buckets.
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Logged query parameters are cut to this many characters (executemany
+# batches can carry thousands of rows).
+MAX_LOGGED_PARAMS = 500
+
+# How SQLAlchemy got each statement's compiled form: from its compiled
+# cache, by compiling it (a miss), or without caching (DDL, raw SQL).
+CACHE_RESULTS = {default.CACHE_HIT: "hit", default.CACHE_MISS: "miss"}
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised in strict mode when a request goes over its query or row budget."""
+
+
+class RequestQueries:
+    """Database work done on behalf of one request."""
+
+    __slots__ = ("count", "seconds", "rows", "compiles", "streamed", "scope")
+
+    def __init__(self, scope=None):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        # Statements that had to be compiled (compiled cache misses).
+        self.compiles = 0
+        # Set by exempt_row_budget() for streamed responses.
+        self.streamed = False
+        # ASGI scope of the request, used to name it in log messages.
+        self.scope = scope
+
+    @property
+    def route(self):
+        if self.scope is None:
+            return "(no request)"
+        # Once routed, the scope holds the matched route's path template.
+        route = self.scope.get("route")
+        return f"{self.scope.get('method', '')} {getattr(route, 'path', self.scope.get('path'))}"
+
+
+# Set by the API's metrics middleware for the duration of each request.
+# Holds a mutable RequestQueries, so updates made from threadpool workers
+# (which run in a copy of the context) are still seen by the request.
+request_queries = ContextVar("request_queries", default=None)
+
+
+class QueryMonitor:
+    """
+    Times executed statements via cursor-execute events: a process-wide
+    duration histogram, plus per-request totals when a RequestQueries is
+    active.
+
+    Statements slower than slow_query_seconds are logged with their
+    parameters and the route that issued them. Requests that run more than
+    query_budget statements or fetch more than row_budget rows are
+    reported by over_budget(); with strict=True the statement (or fetch)
+    that crosses the budget raises QueryBudgetExceeded instead, which is
+    how tests catch N+1 queries and full scans. A budget of 0 is no limit.
+
+    Each statement's compiled cache result is counted in statement_cache
+    (hit, miss or uncached); once warmed up, requests should only hit.
+
+    Statements run on many threads (the threadpool, and several per request
+    when a handler gathers queries), so counters are updated under a lock.
+    """
+
+    def __init__(self, slow_query_seconds=0.5, query_budget=0, row_budget=0, strict=False):
+        self.duration = Histogram(QUERY_BUCKETS)
+        self.slow_query_seconds = slow_query_seconds
+        self.query_budget = query_budget
+        self.row_budget = row_budget
+        self.strict = strict
+        self.slow_queries = 0
+        self.statement_cache = {"hit": 0, "miss": 0, "uncached": 0}
+        self._lock = threading.Lock()
+
+    def install(self, target=Engine):
+        # Listening on the Engine class covers every engine in the process,
+        # including the sync engine that backs an AsyncEngine.
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(target, "handle_error", self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = request_queries.get()
+        if self.strict and stats is not None and self.query_budget and stats.count >= self.query_budget:
+            raise QueryBudgetExceeded(
+                f"{stats.route} ran more than {self.query_budget} queries; next: {statement}"
+            )
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        self.duration.observe(elapsed)
+        cache_result = CACHE_RESULTS.get(getattr(context, "cache_hit", None), "uncached")
+        slow = bool(self.slow_query_seconds) and elapsed >= self.slow_query_seconds
+        stats = request_queries.get()
+        with self._lock:
+            self.statement_cache[cache_result] += 1
+            if slow:
+                self.slow_queries += 1
+            if stats is not None:
+                stats.count += 1
+                stats.seconds += elapsed
+                if cache_result == "miss":
+                    stats.compiles += 1
+        if slow:
+            params = repr(parameters)
+            if len(params) > MAX_LOGGED_PARAMS:
+                params = params[:MAX_LOGGED_PARAMS] + "..."
+            route = stats.route if stats is not None else "(no request)"
+            logger.warning("Slow query (%.1f ms) from %s: %s | parameters: %s",
+                           elapsed * 1000, route, statement, params)
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute.
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    def record_rows(self, count):
+        stats = request_queries.get()
+        if stats is None:
+            return
+        with self._lock:
+            stats.rows += count
+        if self.strict and self.row_budget and not stats.streamed and stats.rows > self.row_budget:
+            raise QueryBudgetExceeded(f"{stats.route} fetched more than {self.row_budget} rows")
+
+    def over_budget(self, stats):
+        """Descriptions of the budgets a request exceeded (empty if none)."""
+        exceeded = []
+        if self.query_budget and stats.count > self.query_budget:
+            exceeded.append(f"queries={stats.count}/{self.query_budget}")
+        if self.row_budget and not stats.streamed and stats.rows > self.row_budget:
+            exceeded.append(f"rows={stats.rows}/{self.row_budget}")
+        return exceeded
+
+    def snapshot(self):
+        return self.duration.snapshot()
+
+
+def query_monitor_from_env():
+    """
+    Build the query monitor from DB_SLOW_QUERY_MS (default 500, 0 disables
+    the slow-query log), DB_QUERY_BUDGET and DB_ROW_BUDGET (per request,
+    default 0 = unlimited) and DB_BUDGET_STRICT.
+    """
+    options = {}
+    for env_name, option in (("DB_SLOW_QUERY_MS", "slow_query_seconds"),
+                             ("DB_QUERY_BUDGET", "query_budget"),
+                             ("DB_ROW_BUDGET", "row_budget")):
+        value = os.getenv(env_name)
+        if value:
+            try:
+                options[option] = float(value) / 1000 if env_name == "DB_SLOW_QUERY_MS" else int(value)
+            except ValueError:
+                raise ValueError(f"{env_name} must be a number, got: {value}")
+    options["strict"] = os.getenv("DB_BUDGET_STRICT", "false").lower() in ("1", "true", "yes")
+    return QueryMonitor(**options)
+
+
+query_monitor = query_monitor_from_env()
+query_monitor.install()
+
+
+def record_rows(count):
+    """Count rows fetched by the current request against its row budget."""
+    query_monitor.record_rows(count)
+
+
+def exempt_row_budget():
+    """
+    Exempt the current request from DB_ROW_BUDGET. For streamed exports,
+    which read every row by design and have already sent their headers by
+    the time the budget would be crossed (strict mode would cut the file
+    short). Their rows are still counted, and the query budget still holds.
+    """
+    stats = request_queries.get()
+    if stats is not None:
+        stats.streamed = True
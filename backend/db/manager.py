@@ -0,0 +1,133 @@
+import asyncio
+import inspect
+import logging
+import os
+import random
+
+logger = logging.getLogger(__name__)
+
+# Connection states reported by DatabaseManager.state.
+STARTING = "starting"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+STOPPED = "stopped"
+
+
+class DatabaseManager:
+    """
+    Owns the ops object for the app and keeps it usable.
+
+    start() returns immediately; a background task builds the ops object
+    with `factory`, checks the database answers, brings `tables` up to
+    their declared schema, and marks the database ready. Failures are
+    retried with exponential backoff and jitter (retry_initial doubling
+    up to retry_max seconds). Once ready, the database is pinged every
+    health_interval seconds, and a failed ping marks it unavailable (so
+    requests fail fast with 503) until a later ping succeeds. The engine
+    and its pool are kept throughout; pre-ping replaces dead connections.
+
+    `housekeeping` lists (method name, *args) ops calls made after every
+    successful ping, for periodic cleanup; their failures are only logged.
+    """
+
+    def __init__(self, factory, tables=(), retry_initial=0.5, retry_max=30.0, health_interval=10.0,
+                 housekeeping=()):
+        self.factory = factory
+        self.tables = tuple(tables)
+        self.housekeeping = tuple(housekeeping)
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.health_interval = health_interval
+        self.ops = None
+        self.state = STARTING
+        self.last_error = None
+        self.failures = 0
+        self._schema_ready = False
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    async def _call(self, method, *args):
+        if inspect.iscoroutinefunction(method):
+            return await method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def connect(self):
+        """One connection attempt; raises on failure."""
+        if self.ops is None:
+            self.ops = await asyncio.to_thread(self.factory)
+        await self._call(self.ops.ping)
+        if not self._schema_ready:
+            for table_name in self.tables:
+                await self._call(self.ops.ensure_table, table_name)
+            self._schema_ready = True
+
+    async def _housekeeping(self):
+        for method_name, *args in self.housekeeping:
+            try:
+                await self._call(getattr(self.ops, method_name), *args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Database housekeeping (%s) failed: %s", method_name, e)
+
+    async def _run(self):
+        delay = self.retry_initial
+        while True:
+            try:
+                if self.ready:
+                    await self._call(self.ops.ping)
+                else:
+                    await self.connect()
+                    logger.info("Database is ready")
+                    self.state, self.last_error, delay = READY, None, self.retry_initial
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.ready:
+                    logger.warning("Lost the database connection: %s", e)
+                else:
+                    logger.warning("Database not available (retrying in %.1fs): %s", delay, e)
+                self.state, self.last_error = UNAVAILABLE, str(e)
+                self.failures += 1
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.retry_max)
+                continue
+            await self._housekeeping()
+            await asyncio.sleep(self.health_interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.ops is not None:
+            await self._call(self.ops.close_connection)
+        self.state = STOPPED
+
+    def status(self):
+        return {"state": self.state, "failures": self.failures, "last_error": self.last_error}
+
+
+def manager_from_env(factory, tables=(), housekeeping=()):
+    """
+    Build the manager with DB_RETRY_INITIAL / DB_RETRY_MAX (backoff bounds,
+    seconds) and DB_HEALTH_INTERVAL (seconds between pings once ready).
+    """
+    return DatabaseManager(
+        factory,
+        tables=tables,
+        retry_initial=float(os.getenv("DB_RETRY_INITIAL", "0.5")),
+        retry_max=float(os.getenv("DB_RETRY_MAX", "30")),
+        health_interval=float(os.getenv("DB_HEALTH_INTERVAL", "10")),
+        housekeeping=housekeeping,
+    )
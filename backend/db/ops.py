@@ -1,91 +1,1081 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, select, and_, text
+from sqlalchemy import create_engine, inspect, MetaData, Table, Column, String, Integer, Numeric, Float, select, and_, or_, bindparam, case, cast, column, func, literal_column, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+import csv
+import io
+import json
+import logging
 import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from db.instrument import record_rows
+from db.pool import PoolMonitor, pool_options_from_env
+from db.schema import NOTIFY_CHANNELS, NOTIFY_MAX_ROWS, SEARCH_CONFIG, SEARCH_VECTOR, SEARCHABLE, TABLES
 
-class SQLAlchemyOps:
+logger = logging.getLogger(__name__)
+
+# Rows per executemany batch in bulk_insert, and the row count from which
+# PostgreSQL loads switch to COPY FROM STDIN.
+BULK_BATCH_SIZE = int(os.getenv("DB_BULK_BATCH_SIZE", "1000"))
+COPY_THRESHOLD = int(os.getenv("DB_COPY_THRESHOLD", "10000"))
+
+# Rows fetched per round trip by iter_data's server-side cursor.
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
+# Table recording the Idempotency-Key of each POST (see insert_idempotent).
+IDEMPOTENCY_TABLE = "idempotency_keys"
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more; changed rows
+# whose payload would be larger are announced without their values.
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class IdempotencyKeyReused(ValueError):
+    """An idempotency key was sent again with a different request."""
+
+
+# Suffixes accepted in condition keys, e.g. {"price__gte": 10, "name__contains": "py"}.
+# A key without a suffix is an equality match.
+CONDITION_OPERATORS = {
+    "eq": lambda col, v: col == v,
+    "ne": lambda col, v: col != v,
+    "lt": lambda col, v: col < v,
+    "lte": lambda col, v: col <= v,
+    "gt": lambda col, v: col > v,
+    "gte": lambda col, v: col >= v,
+    "in": lambda col, v: col.in_(v),
+    "contains": lambda col, v: col.icontains(v, autoescape=True),
+}
+
+
+def build_where(table, condition):
+    clauses = []
+    for key, value in condition.items():
+        name, _, op = key.partition("__")
+        if op and op not in CONDITION_OPERATORS:
+            raise ValueError(f"Unsupported condition operator: {op}")
+        col = getattr(table.c, name)
+        # Compare numbers numerically even on legacy string-typed columns.
+        if (op in ("lt", "lte", "gt", "gte")
+                and isinstance(value, (int, float))
+                and not isinstance(col.type, (Integer, Numeric))):
+            col = cast(col, Numeric)
+        clauses.append(CONDITION_OPERATORS[op or "eq"](col, value))
+    return and_(*clauses)
+
+
+def build_database_url(database_url=None):
+    if database_url:
+        # Use provided database URL (useful for testing)
+        return database_url
+    else:
+        # Build URL from environment variables with defaults
+        database = os.getenv("DB_NAME", "postgres")
+        host = os.getenv("DB_HOST", "localhost")
+        user = os.getenv("DB_USER", "postgres")
+        password = os.getenv("DB_PASS", "postgres")
+        port = os.getenv("DB_PORT", "5432")
+
+        # Validate environment variables
+        if not all([database, host, user, password, port]):
+            missing_vars = []
+            if not database: missing_vars.append("DB_NAME")
+            if not host: missing_vars.append("DB_HOST")
+            if not user: missing_vars.append("DB_USER")
+            if not password: missing_vars.append("DB_PASS")
+            if not port: missing_vars.append("DB_PORT")
+
+            raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+        # Validate port is numeric
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError(f"DB_PORT must be a valid integer, got: {port}")
+
+        return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+
+
+def schema_matches(inspector, table_name):
+    target = TABLES[table_name](MetaData(), table_name)
+    existing = {c["name"]: c["type"] for c in inspector.get_columns(table_name)}
+    pk = inspector.get_pk_constraint(table_name)["constrained_columns"]
+    if pk != [c.name for c in target.primary_key]:
+        return False
+    return all(
+        col.name in existing
+        and existing[col.name]._type_affinity is col.type._type_affinity
+        for col in target.columns
+    )
+
+
+def trigram_available(conn):
+    return conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+
+
+def search_indexes(table_name, trigram=True):
+    spec = SEARCHABLE[table_name]
+    names = [f"ix_{table_name}_search"]
+    if trigram:
+        names += [f"ix_{table_name}_{col}_trgm" for col in spec["trigram"]]
+    return names
+
+
+def search_current(inspector, table_name):
+    # True unless a searchable PostgreSQL table lacks its search column or
+    # indexes. Trigram indexes are only expected once pg_trgm is installed.
+    if inspector.dialect.name != "postgresql" or table_name not in SEARCHABLE:
+        return True
+    columns = {c["name"] for c in inspector.get_columns(table_name)}
+    indexes = {ix["name"] for ix in inspector.get_indexes(table_name)}
+    expected = search_indexes(table_name, trigram=trigram_available(inspector.bind))
+    return SEARCH_VECTOR in columns and all(name in indexes for name in expected)
+
+
+def notify_triggers(table_name):
+    return [f"{table_name}_notify_{op}" for op in ("insert", "update", "delete")]
+
+
+def notify_current(inspector, table_name):
+    # True unless a PostgreSQL table with a NOTIFY channel lacks its triggers.
+    if inspector.dialect.name != "postgresql" or table_name not in NOTIFY_CHANNELS:
+        return True
+    found = {row.tgname for row in inspector.bind.execute(
+        text("SELECT tgname FROM pg_trigger WHERE tgrelid = to_regclass(:table)"),
+        {"table": inspector.dialect.identifier_preparer.quote(table_name)},
+    )}
+    return all(name in found for name in notify_triggers(table_name))
+
+
+def identity_current(inspector, table_name):
+    # PostgreSQL only: declared identity columns are identities with the
+    # declared sequence cache.
+    if inspector.dialect.name != "postgresql":
+        return True
+    target = TABLES[table_name](MetaData(), table_name)
+    existing = {c["name"]: c.get("identity") for c in inspector.get_columns(table_name)}
+    return all(
+        existing.get(col.name) and existing[col.name].get("cache") == col.identity.cache
+        for col in target.columns if col.identity is not None
+    )
+
+
+def schema_current(inspector, table_name):
+    if not inspector.has_table(table_name):
+        return False
+    indexes = {ix["name"] for ix in inspector.get_indexes(table_name)}
+    target = TABLES[table_name](MetaData(), table_name)
+    return (schema_matches(inspector, table_name)
+            and all(ix.name in indexes for ix in target.indexes)
+            and identity_current(inspector, table_name)
+            and search_current(inspector, table_name)
+            and notify_current(inspector, table_name))
+
+
+def max_key(rows, key="id"):
+    # Largest explicit key among rows (dicts), or None if none has one.
+    return max((row[key] for row in rows if row.get(key) is not None), default=None)
+
+
+def advance_identity(conn, table, key="id", top=None):
+    """
+    Move the key's identity sequence up to `top` (default: the largest key
+    in the table) unless it is already past it. Writers of explicit keys
+    (imports, upserts) call this before inserting, so from then on the
+    sequence can't hand out their keys. Concurrent calls are serialised
+    by a transaction-scoped advisory lock, so the sequence never moves
+    back. setval() is not transactional, so callers run this in its own
+    short transaction before the write: the lock is then held for one
+    round trip, not for the whole write. PostgreSQL only; SQLite derives
+    the next key from the table.
+
+    Values a session has already cached from the sequence (DB_ID_CACHE,
+    see db.schema.ID_CACHE) are not affected by setval and can still
+    collide with an explicit key.
+    """
+    col = getattr(table.c, key)
+    if conn.dialect.name != "postgresql" or col.identity is None:
+        return
+    preparer = conn.dialect.identifier_preparer
+    quoted = preparer.format_table(table)
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"identity:{quoted}"})
+    params = {"table": quoted, "column": key}
+    if top is None:
+        top_sql = f"(SELECT max({preparer.quote(key)}) FROM {quoted})"
+    else:
+        top_sql, params["top"] = ":top", top
+    conn.execute(text(
+        "SELECT setval(seq, top) FROM ("
+        f"SELECT pg_get_serial_sequence(:table, :column)::regclass AS seq, {top_sql} AS top) s "
+        "WHERE top > coalesce(pg_sequence_last_value(seq), 0)"
+    ), params)
+
+
+def ensure_identity(conn, table_name):
+    # Turn plain key columns of existing PostgreSQL tables into identities,
+    # starting after the largest existing key, and apply cache changes.
+    if conn.dialect.name != "postgresql":
+        return
+    target = TABLES[table_name](MetaData(), table_name)
+    existing = {c["name"]: c.get("identity") for c in inspect(conn).get_columns(table_name)}
+    preparer = conn.dialect.identifier_preparer
+    for col in target.columns:
+        if col.identity is None:
+            continue
+        alter = f"ALTER TABLE {preparer.format_table(target)} ALTER COLUMN {preparer.quote(col.name)}"
+        identity = existing.get(col.name)
+        if not identity:
+            conn.execute(text(f"{alter} ADD GENERATED BY DEFAULT AS IDENTITY (CACHE {col.identity.cache})"))
+            advance_identity(conn, target, col.name)
+        elif identity.get("cache") != col.identity.cache:
+            conn.execute(text(f"{alter} SET CACHE {col.identity.cache}"))
+
+
+def ensure_search(conn, table_name):
+    """
+    Add the generated search column and its GIN indexes to a searchable
+    table (PostgreSQL only; see db.schema.SEARCHABLE). Trigram indexes are
+    skipped, with a warning, when pg_trgm cannot be installed.
+    """
+    if conn.dialect.name != "postgresql" or table_name not in SEARCHABLE:
+        return
+    spec = SEARCHABLE[table_name]
+    preparer = conn.dialect.identifier_preparer
+    table = preparer.quote(table_name)
+    vector = " || ".join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce({preparer.quote(col)}, '')), '{weight}')"
+        for col, weight in spec["weights"].items()
+    )
+    search_index, *trigram_indexes = search_indexes(table_name)
+    conn.execute(text(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR} tsvector "
+        f"GENERATED ALWAYS AS ({vector}) STORED"
+    ))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {search_index} ON {table} USING gin ({SEARCH_VECTOR})"))
+    if not spec["trigram"]:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except SQLAlchemyError as e:
+        logger.warning("pg_trgm is not available, search will not match prefixes or typos: %s", e)
+        return
+    for index, col in zip(trigram_indexes, spec["trigram"]):
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {index} ON {table} USING gin ({preparer.quote(col)} gin_trgm_ops)"
+        ))
+
+
+def ensure_notify(conn, table_name):
+    """
+    Install the triggers that NOTIFY a table's changes on its channel
+    (PostgreSQL only; see db.schema.NOTIFY_CHANNELS). They run once per
+    statement over its transition table, so a bulk write costs one
+    trigger call, and one reset notification past NOTIFY_MAX_ROWS rows.
+    """
+    if conn.dialect.name != "postgresql" or table_name not in NOTIFY_CHANNELS:
+        return
+    target = TABLES[table_name](MetaData(), table_name)
+    preparer = conn.dialect.identifier_preparer
+    table = preparer.quote(table_name)
+    function = preparer.quote(f"{table_name}_notify_changes")
+    channel = NOTIFY_CHANNELS[table_name]
+    key = preparer.quote(target.primary_key.columns.values()[0].name)
+    fields = ", ".join(f"'{col.name}', {preparer.quote(col.name)}" for col in target.columns)
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            written bigint;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                SELECT count(*) INTO written FROM old_rows;
+            ELSE
+                SELECT count(*) INTO written FROM new_rows;
+            END IF;
+            IF written > {NOTIFY_MAX_ROWS} THEN
+                PERFORM pg_notify('{channel}', '{{"op": "reset"}}');
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{channel}', json_build_object('op', 'delete', 'id', {key})::text)
+                FROM old_rows;
+            ELSE
+                PERFORM pg_notify('{channel}', CASE
+                    WHEN octet_length(payload::text) <= {NOTIFY_PAYLOAD_LIMIT} THEN payload::text
+                    ELSE json_build_object('op', lower(TG_OP), 'id', {key})::text END)
+                FROM (SELECT {key}, json_build_object('op', lower(TG_OP), 'id', {key},
+                                                       'row', json_build_object({fields})) AS payload
+                      FROM new_rows) changes;
+            END IF;
+            RETURN NULL;
+        END $$
+    """))
+    for trigger, op in zip(notify_triggers(table_name), ("INSERT", "UPDATE", "DELETE")):
+        # Transition tables need one trigger per event.
+        transition = "OLD TABLE AS old_rows" if op == "DELETE" else "NEW TABLE AS new_rows"
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {preparer.quote(trigger)} ON {table}"))
+        conn.execute(text(
+            f"CREATE TRIGGER {preparer.quote(trigger)} AFTER {op} ON {table} "
+            f"REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        ))
+
+
+def migrate_schema(conn, table_name):
+    legacy_name = f"{table_name}_legacy"
+    preparer = conn.dialect.identifier_preparer
+    conn.execute(text(
+        f"ALTER TABLE {preparer.quote(table_name)} RENAME TO {preparer.quote(legacy_name)}"
+    ))
+    legacy = Table(legacy_name, MetaData(), autoload_with=conn)
+    target = TABLES[table_name](MetaData(), table_name)
+    target.create(conn)
+    names = [col.name for col in target.columns if col.name in legacy.c]
+    conn.execute(target.insert().from_select(
+        names,
+        select(*(cast(legacy.c[name], target.c[name].type) for name in names)),
+    ))
+    legacy.drop(conn)
+    for col in target.primary_key:
+        advance_identity(conn, target, col.name)
+
+
+def ensure_schema(conn, table_name):
+    # Runs inside the caller's transaction; returns True if any DDL ran.
+    if conn.dialect.name == "postgresql":
+        # Serialise concurrent startups; the losers wait here and then
+        # find the schema already current.
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+            {"name": f"ensure_table:{table_name}"},
+        )
+    inspector = inspect(conn)
+    if schema_current(inspector, table_name):
+        return False
+    target = TABLES[table_name](MetaData(), table_name)
+    if not inspector.has_table(table_name):
+        target.create(conn)
+    elif not schema_matches(inspector, table_name):
+        migrate_schema(conn, table_name)
+    else:
+        for index in target.indexes:
+            index.create(conn, checkfirst=True)
+    ensure_identity(conn, table_name)
+    ensure_search(conn, table_name)
+    ensure_notify(conn, table_name)
+    return True
+
+
+def select_stmt(table, condition=None, limit=None, after=None, key="id"):
+    stmt = select(table)
+    if condition:
+        stmt = stmt.where(build_where(table, condition))
+    if limit is not None or after is not None:
+        # Keyset pagination: rows strictly after the last key seen.
+        key_col = getattr(table.c, key)
+        if after is not None:
+            stmt = stmt.where(key_col > after)
+        stmt = stmt.order_by(key_col).limit(limit)
+    return stmt
+
+
+def fulltext_search_stmt(table, query, limit, key="id"):
+    # Ranked full-text matches on the generated search column. The query
+    # uses web search syntax: words, "quoted phrases", OR and -excluded.
+    tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), query)
+    vector = column(SEARCH_VECTOR)
+    rank = cast(func.ts_rank_cd(vector, tsquery), Float).label("rank")
+    return (
+        select(table, rank)
+        .where(vector.bool_op("@@")(tsquery))
+        .order_by(rank.desc(), getattr(table.c, key))
+        .limit(limit)
+    )
+
+
+def trigram_search_stmt(table, query, limit, columns, exclude=(), key="id"):
+    # Substring and fuzzy (word similarity) matches, served by the pg_trgm
+    # GIN indexes; finds prefixes and misspellings full-text search misses.
+    cols = [getattr(table.c, name) for name in columns]
+    scores = [func.word_similarity(query, col) for col in cols]
+    rank = cast(scores[0] if len(scores) == 1 else func.greatest(*scores), Float).label("rank")
+    stmt = select(table, rank).where(or_(
+        *(col.bool_op("%>")(query) for col in cols),
+        *(col.icontains(query, autoescape=True) for col in cols),
+    ))
+    if exclude:
+        stmt = stmt.where(getattr(table.c, key).not_in(exclude))
+    return stmt.order_by(rank.desc(), getattr(table.c, key)).limit(limit)
+
+
+def like_search_stmt(table, query, limit, weights, key="id"):
+    # Portable fallback for other databases: every word must appear in one
+    # of the searchable columns; matches in the top-weighted column rank first.
+    terms = query.split()
+    cols = [getattr(table.c, name) for name in weights]
+    match = and_(*(or_(*(col.icontains(term, autoescape=True) for col in cols)) for term in terms))
+    rank = cast(sum(case((cols[0].icontains(term, autoescape=True), 1), else_=0) for term in terms), Float)
+    rank = rank.label("rank")
+    return select(table, rank).where(match).order_by(rank.desc(), getattr(table.c, key)).limit(limit)
+
+
+def sortable_columns(table, key="id"):
+    # Lists may be sorted by the key or by a column with its own index;
+    # anything else would sort the whole table per page.
+    names = {key}
+    for index in table.indexes:
+        if len(index.columns) == 1:
+            names.update(col.name for col in index.columns)
+    return names
+
+
+def sorted_select_stmt(table, condition, limit, sort, descending=False, after=None, key="id"):
+    # Keyset pagination on (sort, key): after is the (sort value, key) of
+    # the last row seen, and the key breaks ties between equal sort values.
+    sort_col, key_col = getattr(table.c, sort), getattr(table.c, key)
+    stmt = select(table)
+    if condition:
+        stmt = stmt.where(build_where(table, condition))
+    if after is not None:
+        position = tuple_(sort_col, key_col)
+        stmt = stmt.where(position < tuple_(*after) if descending else position > tuple_(*after))
+    order = (sort_col.desc(), key_col.desc()) if descending else (sort_col, key_col)
+    return stmt.order_by(*order).limit(limit)
+
+
+def stats_stmt(table, column_name, condition=None):
+    col = getattr(table.c, column_name)
+    stmt = select(
+        func.count().label("count"),
+        cast(func.min(col), Float).label("min"),
+        cast(func.max(col), Float).label("max"),
+        cast(func.round(func.avg(col), 2), Float).label("avg"),
+        cast(func.sum(col), Float).label("sum"),
+    ).select_from(table)
+    if condition:
+        stmt = stmt.where(build_where(table, condition))
+    return stmt
+
+
+def update_stmt(table, set_values, condition):
+    return table.update().where(build_where(table, condition)).values(**set_values)
+
+
+def delete_stmt(table, condition):
+    return table.delete().where(build_where(table, condition))
+
+
+def dialect_insert(table, dialect_name):
+    # INSERT construct with ON CONFLICT support for the given dialect.
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    if dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"ON CONFLICT is not supported on {dialect_name} databases")
+
+
+def upsert_stmt(table, dialect_name, key="id"):
+    # INSERT ... ON CONFLICT (key) DO UPDATE every other column, returning
+    # the stored rows in parameter order (also for executemany batches).
+    stmt = dialect_insert(table, dialect_name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={col.name: stmt.excluded[col.name] for col in table.columns if col.name != key},
+    )
+    return stmt.returning(*table.c, sort_by_parameter_order=True)
+
+
+def update_many_stmt(table, key="id"):
+    # The SET clause comes from the executemany parameters; the key is
+    # bound separately because SET parameters take the column names.
+    return table.update().where(getattr(table.c, key) == bindparam("_key"))
+
+
+class TableStatements:
+    """
+    The hot single-row and keyset statements of one table, built once with
+    bind parameters (_key, _after, _limit; SET and INSERT values come from
+    the column-named parameters). Reusing the same statement objects skips
+    rebuilding the construct and its cache key on every call, and always
+    renders the same SQL, so SQLAlchemy's compiled cache and the driver's
+    prepared statements (asyncpg) are reused.
+    """
+
+    def __init__(self, table, key="id"):
+        key_col = getattr(table.c, key)
+        self.table = table
+        self.key = key
+        self._upsert = None
+        self.insert = table.insert()
+        self.get = select(table).where(key_col == bindparam("_key"))
+        self.update = update_many_stmt(table, key)
+        self.update_returning = self.update.returning(*table.c)
+        self.delete = table.delete().where(key_col == bindparam("_key"))
+        self.insert_returning = self.insert.returning(*table.c)
+        self.first_page = select(table).order_by(key_col).limit(bindparam("_limit"))
+        self.next_page = (
+            select(table).where(key_col > bindparam("_after")).order_by(key_col).limit(bindparam("_limit"))
+        )
+
+    def upsert(self, dialect_name):
+        # Dialect-specific, so built on first use.
+        if self._upsert is None:
+            self._upsert = upsert_stmt(self.table, dialect_name, self.key)
+        return self._upsert
+
+    def row_params(self, data):
+        # Positional row values (in column order) as insert parameters.
+        return dict(zip(self.table.columns.keys(), data))
+
+    def page(self, limit, after=None):
+        # (statement, parameters) for a keyset page without filters.
+        if after is None:
+            return self.first_page, {"_limit": limit}
+        return self.next_page, {"_limit": limit, "_after": after}
+
+
+def group_by_columns(rows):
+    # Offsets of rows grouped by the columns they set, so that each group
+    # can be inserted with one executemany (e.g. rows with and without ids).
+    groups = {}
+    for offset, row in enumerate(rows):
+        groups.setdefault(tuple(sorted(row)), []).append(offset)
+    return list(groups.values())
+
+
+def condition_key(condition, key="id"):
+    """
+    The key value when condition selects exactly one row by key (and can
+    use the prebuilt statements), otherwise None.
+    """
+    if condition and len(condition) == 1 and key in condition:
+        return condition[key]
+    return None
+
+
+def group_row_updates(rows, key="id"):
+    """
+    Group per-row updates by the columns they set, as executemany
+    parameters for update_many_stmt. Rows that set nothing are dropped.
+    """
+    groups = {}
+    for row in rows:
+        values = {col: value for col, value in row.items() if col != key}
+        if values:
+            groups.setdefault(tuple(sorted(values)), []).append({"_key": row[key], **values})
+    return list(groups.values())
+
+
+def row_dicts(result):
+    # Rows as plain dicts, counted against the current request's row budget.
+    rows = [dict(row._mapping) for row in result]
+    record_rows(len(rows))
+    return rows
+
+
+def split_page(rows, limit, key="id", sort=None):
+    # Pages are fetched with limit + 1 rows: the extra row tells us whether
+    # another page exists without a COUNT. Sorted pages continue from the
+    # last row's (sort value, key).
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, (last[sort], last[key]) if sort is not None else last[key]
+    return rows, None
+
+
+class TableRegistry:
+    """
+    Table objects keyed by name, shared by the sync and async ops. Declared
+    tables are built from db.schema; others are reflected once and cached
+    until invalidate_table() is called.
+    """
+
+    def _init_table_registry(self):
+        self.metadata = MetaData()
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+        self.table_cache_hits = 0
+        self.table_cache_misses = 0
+        self._statements = {}
+
+    def _cached_table(self, table_name):
+        table = self._tables.get(table_name)
+        if table is not None:
+            self.table_cache_hits += 1
+        return table
+
+    def _declared_table(self, table_name):
+        if table_name in TABLES:
+            return TABLES[table_name](self.metadata, table_name)
+        return None
+
+    def _table_statements(self, table, key="id"):
+        statements = self._statements.get((table.name, key))
+        if statements is None or statements.table is not table:
+            # Built on first use, and rebuilt once the table was replaced.
+            statements = self._statements[(table.name, key)] = TableStatements(table, key)
+        return statements
+
+    def invalidate_table(self, table_name=None):
+        # Call after any schema change so the next access reflects again.
+        names = [table_name] if table_name else list(self._tables)
+        for name in names:
+            self._tables.pop(name, None)
+            for statement_key in [k for k in self._statements if k[0] == name]:
+                del self._statements[statement_key]
+            if name in self.metadata.tables:
+                self.metadata.remove(self.metadata.tables[name])
+
+    def table_cache_stats(self):
+        return {
+            "hits": self.table_cache_hits,
+            "misses": self.table_cache_misses,
+            "tables": sorted(self._tables),
+            "prebuilt_statements": sorted(name for name, _ in self._statements),
+        }
+
+
+class SQLAlchemyOps(TableRegistry):
     def __init__(self, database_url=None):
         load_dotenv()
         
-        if database_url:
-            # Use provided database URL (useful for testing)
-            url = database_url
-        else:
-            # Build URL from environment variables with defaults
-            database = os.getenv("DB_NAME", "postgres")
-            host = os.getenv("DB_HOST", "localhost")
-            user = os.getenv("DB_USER", "postgres")
-            password = os.getenv("DB_PASS", "postgres")
-            port = os.getenv("DB_PORT", "5432")
-            
-            # Validate environment variables
-            if not all([database, host, user, password, port]):
-                missing_vars = []
-                if not database: missing_vars.append("DB_NAME")
-                if not host: missing_vars.append("DB_HOST")
-                if not user: missing_vars.append("DB_USER")
-                if not password: missing_vars.append("DB_PASS")
-                if not port: missing_vars.append("DB_PORT")
-                
-                raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-            
-            # Validate port is numeric
-            try:
-                port = int(port)
-            except ValueError:
-                raise ValueError(f"DB_PORT must be a valid integer, got: {port}")
-            
-            url = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
-        
+        url = build_database_url(database_url)
+        pool_options = pool_options_from_env()
+
         try:
-            self.engine = create_engine(url)
-            self.metadata = MetaData()
+            self.engine = create_engine(url, **pool_options)
+            # Sessions are created on demand; none is held open here, so
+            # every pool slot is available to the request paths.
             self.Session = sessionmaker(bind=self.engine)
-            self.session = self.Session()
         except Exception as e:
             raise ConnectionError(f"Failed to connect to database: {e}")
 
-    def create_table(self, table_name, columns):
-        table = Table(
-            table_name, self.metadata,
-            Column('id', Integer),
-            *(Column(col, String) for col in columns if col != 'id'),
-            extend_existing=True
-        )
+        self.pool_monitor = PoolMonitor(self.engine)
+        self._init_table_registry()
+
+    @contextmanager
+    def _connect(self):
+        # engine.connect() checks a connection out of the pool; time the wait.
+        start = time.perf_counter()
+        try:
+            conn = self.engine.connect()
+        except PoolTimeoutError:
+            self.pool_monitor.record_timeout()
+            raise
+        self.pool_monitor.observe_wait(time.perf_counter() - start)
+        with conn:
+            yield conn
+
+    @contextmanager
+    def _begin(self):
+        with self._connect() as conn, conn.begin():
+            yield conn
+
+    def pool_stats(self):
+        return self.pool_monitor.snapshot()
+
+    def ping(self):
+        # Cheapest round trip to the database, for health checks.
+        with self._connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    def get_table(self, table_name):
+        table = self._cached_table(table_name)
+        if table is not None:
+            return table
+        with self._tables_lock:
+            table = self._tables.get(table_name)
+            if table is None:
+                self.table_cache_misses += 1
+                table = self._declared_table(table_name)
+                if table is None:
+                    table = Table(table_name, self.metadata, autoload_with=self.engine)
+                self._tables[table_name] = table
+        return table
+
+    def create_table(self, table_name, columns=None):
+        # Drops and recreates the table (all rows are lost); use
+        # ensure_table() for a non-destructive setup.
+        # Without columns, the table is built from its declared schema.
+        self.invalidate_table(table_name)
+        if columns is None:
+            table = TABLES[table_name](self.metadata, table_name)
+        else:
+            table = Table(
+                table_name, self.metadata,
+                Column('id', Integer),
+                *(Column(col, String) for col in columns if col != 'id'),
+                extend_existing=True
+            )
         table.drop(self.engine, checkfirst=True)
         table.create(self.engine, checkfirst=True)
+        if columns is None:
+            with self._begin() as conn:
+                ensure_search(conn, table_name)
+                ensure_notify(conn, table_name)
+        self._tables[table_name] = table
+
+    def schema_matches(self, table_name):
+        # True when the existing table has the declared primary key and
+        # column types; False for legacy all-string tables.
+        return schema_matches(inspect(self.engine), table_name)
+
+    def migrate_table(self, table_name):
+        """
+        Rebuild a legacy table with its declared schema, keeping the rows.
+        Returns True if the table was migrated.
+        """
+        if not inspect(self.engine).has_table(table_name):
+            return False
+        if self.schema_matches(table_name):
+            return False
+        with self._begin() as conn:
+            migrate_schema(conn, table_name)
+        self.invalidate_table(table_name)
+        return True
+
+    def ensure_table(self, table_name):
+        """
+        Bring a declared table up to date without dropping data: create it if
+        missing, migrate it if legacy, add any missing indexes. Returns True
+        if any DDL ran. Safe to call from every worker at startup.
+        """
+        # Fast path: nothing to do means no DDL and no locks.
+        with self._connect() as conn:
+            if schema_current(inspect(conn), table_name):
+                return False
+        with self._begin() as conn:
+            changed = ensure_schema(conn, table_name)
+        self.invalidate_table(table_name)
+        return changed
 
     def insert_data(self, table_name, data):
-        table = Table(table_name, self.metadata, autoload_with=self.engine)
-        ins = table.insert().values(dict(zip(table.columns.keys(), data)))
-        with self.engine.begin() as conn:
-            conn.execute(ins)
-
-    def fetch_data(self, table_name):
-        table = Table(table_name, self.metadata, autoload_with=self.engine)
-        stmt = select(table)
-        with self.engine.connect() as conn:
+        statements = self._table_statements(self.get_table(table_name))
+        params = statements.row_params(data)
+        with self._connect() as conn:
+            if params.get(statements.key) is not None:
+                with conn.begin():
+                    advance_identity(conn, statements.table, statements.key, params[statements.key])
+            with conn.begin():
+                conn.execute(statements.insert, params)
+
+    def insert_returning(self, table_name, row, key="id"):
+        """
+        Insert one row (a dict) and return it as stored. Leave the key out
+        to have the database generate it; it comes back via RETURNING, so
+        allocating an id costs no extra round trip.
+        """
+        statements = self._table_statements(self.get_table(table_name), key)
+        with self._connect() as conn:
+            if row.get(key) is not None:
+                with conn.begin():
+                    advance_identity(conn, statements.table, key, row[key])
+            with conn.begin():
+                return row_dicts(conn.execute(statements.insert_returning, row))[0]
+
+    def bulk_insert(self, table_name, rows, batch_size=None):
+        """
+        Insert many rows (dicts keyed by column name).
+        Returns (inserted_count, errors) where errors is a list of
+        (row_index, message); a bad row never aborts the rest of the load.
+        """
+        if not rows:
+            return 0, []
+        if (self.engine.dialect.name == "postgresql"
+                and self.engine.dialect.driver == "psycopg2"
+                and len(rows) >= COPY_THRESHOLD
+                and len(group_by_columns(rows)) == 1):
+            try:
+                return self.copy_insert(table_name, rows), []
+            except Exception as e:
+                # COPY is all-or-nothing; fall back to find the bad rows.
+                logger.warning("COPY into %s failed, inserting in batches instead: %s", table_name, e)
+
+        table = self.get_table(table_name)
+        batch_size = batch_size or BULK_BATCH_SIZE
+        inserted, errors = 0, []
+        top = max_key(rows)
+        with self._connect() as conn:
+            if top is not None:
+                with conn.begin():
+                    advance_identity(conn, table, top=top)
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                for offsets in group_by_columns(batch):
+                    try:
+                        # executemany; SQLAlchemy batches this into multi-row
+                        # INSERT ... VALUES statements where the driver allows.
+                        with conn.begin():
+                            conn.execute(table.insert(), [batch[offset] for offset in offsets])
+                        inserted += len(offsets)
+                        continue
+                    except SQLAlchemyError:
+                        pass
+                    # Retry the failed rows one by one so only bad rows are lost.
+                    for offset in offsets:
+                        try:
+                            with conn.begin():
+                                conn.execute(table.insert(), batch[offset])
+                            inserted += 1
+                        except SQLAlchemyError as e:
+                            errors.append((start + offset, str(getattr(e, "orig", None) or e)))
+        return inserted, errors
+
+    def copy_insert(self, table_name, rows):
+        # PostgreSQL COPY FROM STDIN: one round trip for the whole load.
+        table = self.get_table(table_name)
+        # The rows share one column set; the others (e.g. a generated id)
+        # are left to their defaults.
+        columns = [col for col in table.columns.keys() if col in rows[0]]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([r"\N" if row.get(col) is None else row.get(col) for col in columns])
+        buffer.seek(0)
+
+        top = max_key(rows)
+        if top is not None:
+            with self._begin() as conn:
+                advance_identity(conn, table, top=top)
+
+        preparer = self.engine.dialect.identifier_preparer
+        copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+            preparer.format_table(table),
+            ", ".join(preparer.quote(col) for col in columns),
+        )
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.copy_expert(copy_sql, buffer)
+            cursor.close()
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+        return len(rows)
+
+    def fetch_data(self, table_name, condition=None, limit=None, after=None, key="id"):
+        table = self.get_table(table_name)
+        stmt = select_stmt(table, condition, limit, after, key)
+        with self._connect() as conn:
             result = conn.execute(stmt)
-            return [dict(row._mapping) for row in result]
+            return row_dicts(result)
+
+    def iter_data(self, table_name, condition=None, key="id", batch_size=None):
+        """
+        Yield matching rows in key order, as lists of up to batch_size dicts.
+        Rows are read through a server-side cursor (stream_results), so the
+        result set is never held in memory at once. The connection stays
+        checked out until the generator is exhausted or closed.
+        """
+        table = self.get_table(table_name)
+        stmt = select_stmt(table, condition).order_by(getattr(table.c, key))
+        with self._connect() as conn:
+            result = conn.execution_options(yield_per=batch_size or STREAM_BATCH_SIZE).execute(stmt)
+            for partition in result.partitions():
+                yield row_dicts(partition)
+
+    def fetch_page(self, table_name, limit, after=None, condition=None, key="id", sort=None, descending=False):
+        """
+        One keyset page: (rows, next) where next is passed back as `after`
+        for the following page, or None on the last page. Pages are in key
+        order unless sort names another column (see sortable_columns); then
+        after and next are (sort value, key) pairs.
+        """
+        if sort is not None and (sort != key or descending):
+            stmt = sorted_select_stmt(self.get_table(table_name), condition, limit + 1, sort, descending, after, key)
+            with self._connect() as conn:
+                rows = row_dicts(conn.execute(stmt))
+            return split_page(rows, limit, key, sort)
+        if condition:
+            rows = self.fetch_data(table_name, condition, limit=limit + 1, after=after, key=key)
+        else:
+            stmt, params = self._table_statements(self.get_table(table_name), key).page(limit + 1, after)
+            with self._connect() as conn:
+                rows = row_dicts(conn.execute(stmt, params))
+        return split_page(rows, limit, key)
+
+    def column_stats(self, table_name, column_name, condition=None):
+        """
+        Row count and min/max/avg/sum of one column over the matching rows,
+        computed by the database in one aggregate query.
+        """
+        stmt = stats_stmt(self.get_table(table_name), column_name, condition)
+        with self._connect() as conn:
+            return dict(conn.execute(stmt).one()._mapping)
+
+    def fetch_one(self, table_name, key_value, key="id"):
+        statements = self._table_statements(self.get_table(table_name), key)
+        with self._connect() as conn:
+            row = conn.execute(statements.get, {"_key": key_value}).first()
+            return row_dicts([row])[0] if row is not None else None
+
+    def search(self, table_name, query, limit=20, key="id"):
+        """
+        Rows matching a free-text query, best match first, each with a
+        "rank" score. On PostgreSQL this is full-text search on the
+        generated search column, topped up with trigram matches (prefixes,
+        typos) when it finds fewer than limit rows. Other databases fall
+        back to a LIKE match on the searchable columns.
+        """
+        table = self.get_table(table_name)
+        spec = SEARCHABLE[table_name]
+        with self._connect() as conn:
+            if conn.dialect.name != "postgresql":
+                return row_dicts(conn.execute(like_search_stmt(table, query, limit, spec["weights"], key)))
+            rows = row_dicts(conn.execute(fulltext_search_stmt(table, query, limit, key)))
+            if len(rows) < limit and spec["trigram"] and trigram_available(conn):
+                found = [row[key] for row in rows]
+                stmt = trigram_search_stmt(table, query, limit - len(rows), spec["trigram"], found, key)
+                rows += row_dicts(conn.execute(stmt))
+            return rows
 
     def update_data(self, table_name, set_values, condition):
-        table = Table(table_name, self.metadata, autoload_with=self.engine)
-        stmt = table.update().where(
-            and_(*(getattr(table.c, k) == v for k, v in condition.items()))
-        ).values(**set_values)
-        with self.engine.begin() as conn:
+        table = self.get_table(table_name)
+        stmt = update_stmt(table, set_values, condition)
+        with self._begin() as conn:
+            return conn.execute(stmt).rowcount
+
+    def update_returning(self, table_name, set_values, condition):
+        # Returns the updated rows; an empty list means nothing matched.
+        table = self.get_table(table_name)
+        key = condition_key(condition)
+        if key is not None and self.engine.dialect.update_returning:
+            statements = self._table_statements(table)
+            with self._begin() as conn:
+                return row_dicts(conn.execute(statements.update_returning, {"_key": key, **set_values}))
+        stmt = update_stmt(table, set_values, condition)
+        with self._begin() as conn:
+            if self.engine.dialect.update_returning:
+                result = conn.execute(stmt.returning(*table.c))
+                return row_dicts(result)
+            # No RETURNING support: read the rows back in the same transaction.
+            if conn.execute(stmt).rowcount == 0:
+                return []
+            result = conn.execute(select(table).where(build_where(table, condition)))
+            return row_dicts(result)
+
+    def update_where(self, table_name, set_values, condition, key="id"):
+        """
+        Update every row matching condition in one statement and return the
+        keys of the rows it changed.
+        """
+        table = self.get_table(table_name)
+        stmt = update_stmt(table, set_values, condition)
+        key_col = getattr(table.c, key)
+        with self._begin() as conn:
+            if self.engine.dialect.update_returning:
+                return list(conn.execute(stmt.returning(key_col)).scalars())
+            # No RETURNING: lock and collect the keys in the same transaction.
+            keys = select(key_col).where(build_where(table, condition)).with_for_update()
+            keys = list(conn.execute(keys).scalars())
             conn.execute(stmt)
+            return keys
+
+    def update_many(self, table_name, rows, key="id"):
+        """
+        Apply per-row values (dicts holding the key plus the columns to set)
+        with executemany, in one transaction. Returns the rows updated.
+        """
+        table = self.get_table(table_name)
+        stmt = update_many_stmt(table, key)
+        groups = group_row_updates(rows, key)
+        with self._begin() as conn:
+            if not self.engine.dialect.supports_sane_multi_rowcount:
+                # The driver can't count executemany updates; count the
+                # matching keys up front instead.
+                keys = {params["_key"] for group in groups for params in group}
+                count = select(func.count()).select_from(table).where(getattr(table.c, key).in_(keys))
+                updated = conn.execute(count).scalar()
+                for params in groups:
+                    conn.execute(stmt, params)
+                return updated
+            return sum(conn.execute(stmt, params).rowcount for params in groups)
+
+    def upsert(self, table_name, rows, key="id"):
+        """
+        Insert rows (dicts keyed by column name), updating every other
+        column of rows whose key already exists, with INSERT ... ON CONFLICT
+        DO UPDATE in one transaction. No reads, and no race between
+        concurrent writers of the same key. Returns the stored rows; when a
+        key repeats, the last row for it wins.
+        """
+        rows = list({row[key]: row for row in rows}.values())
+        if not rows:
+            return []
+        table = self.get_table(table_name)
+        stmt = self._table_statements(table, key).upsert(self.engine.dialect.name)
+        stored = []
+        with self._connect() as conn:
+            with conn.begin():
+                advance_identity(conn, table, key, max_key(rows, key))
+            with conn.begin():
+                for start in range(0, len(rows), BULK_BATCH_SIZE):
+                    stored += row_dicts(conn.execute(stmt, rows[start:start + BULK_BATCH_SIZE]))
+        return stored
+
+    def insert_idempotent(self, table_name, row, idempotency_key, fingerprint):
+        """
+        Insert row once per idempotency key. Returns (stored row, replayed):
+        the first call inserts the row and records the key with the stored
+        row in the same transaction; later calls with the key return that
+        row without inserting. A concurrent retry waits on the key's unique
+        index until the first call commits. Raises IdempotencyKeyReused if
+        the key was recorded for a different fingerprint.
+        """
+        statements = self._table_statements(self.get_table(table_name))
+        keys = self.get_table(IDEMPOTENCY_TABLE)
+        claim = dialect_insert(keys, self.engine.dialect.name).on_conflict_do_nothing().returning(keys.c.key)
+        with self._connect() as conn:
+            if row.get(statements.key) is not None:
+                # Harmless when the key turns out to be a replay.
+                with conn.begin():
+                    advance_identity(conn, statements.table, statements.key, row[statements.key])
+            with conn.begin():
+                if conn.execute(claim, {"key": idempotency_key, "fingerprint": fingerprint}).first() is None:
+                    stored = conn.execute(select(keys).where(keys.c.key == idempotency_key)).one()
+                    if stored.fingerprint != fingerprint:
+                        raise IdempotencyKeyReused(f"Idempotency key {idempotency_key!r} was used for a different request")
+                    return json.loads(stored.response), True
+                created = row_dicts(conn.execute(statements.insert_returning, row))[0]
+                conn.execute(keys.update().where(keys.c.key == idempotency_key).values(response=json.dumps(created)))
+                return created, False
+
+    def purge_idempotency_keys(self, max_age_seconds):
+        # Forget keys older than max_age_seconds; returns how many were removed.
+        keys = self.get_table(IDEMPOTENCY_TABLE)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        with self._begin() as conn:
+            return conn.execute(keys.delete().where(keys.c.created_at < cutoff)).rowcount
 
     def delete_data(self, table_name, condition):
-        table = Table(table_name, self.metadata, autoload_with=self.engine)
-        stmt = table.delete().where(
-            and_(*(getattr(table.c, k) == v for k, v in condition.items()))
-        )
-        with self.engine.begin() as conn:
+        table = self.get_table(table_name)
+        key = condition_key(condition)
+        if key is not None:
+            stmt, params = self._table_statements(table).delete, {"_key": key}
+        else:
+            stmt, params = delete_stmt(table, condition), None
+        with self._begin() as conn:
+            return conn.execute(stmt, params).rowcount
+
+    def delete_where(self, table_name, condition, key="id"):
+        # Like delete_data, but returns the keys of the deleted rows.
+        table = self.get_table(table_name)
+        stmt = delete_stmt(table, condition)
+        key_col = getattr(table.c, key)
+        with self._begin() as conn:
+            if self.engine.dialect.delete_returning:
+                return list(conn.execute(stmt.returning(key_col)).scalars())
+            keys = select(key_col).where(build_where(table, condition)).with_for_update()
+            keys = list(conn.execute(keys).scalars())
             conn.execute(stmt)
+            return keys
 
     def close_connection(self):
-        self.session.close()
         self.engine.dispose()
 
 PostgresOps = SQLAlchemyOps
\ No newline at end of file
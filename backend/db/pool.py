@@ -0,0 +1,144 @@
+import bisect
+import os
+import threading
+
+# Upper bounds (seconds) of the connection-wait histogram buckets.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+# Connections kept free for superusers, migrations and admin sessions when
+# per-worker pools are sized from DB_MAX_CONNECTIONS.
+DEFAULT_RESERVED_CONNECTIONS = 5
+
+
+def dedicated_connections():
+    """
+    Connections each worker holds outside its pool: the change feed's
+    LISTEN connection (db/changes.py), unless CHANGES_LISTEN=false.
+    """
+    return 1 if _env_flag("CHANGES_LISTEN", "true") else 0
+
+
+def per_worker_pool(max_connections, workers, reserved=DEFAULT_RESERVED_CONNECTIONS, dedicated=0):
+    """
+    Split a server's connection limit between worker processes. Returns
+    (pool_size, max_overflow) such that
+    workers * (pool_size + max_overflow + dedicated) never exceeds
+    max_connections - reserved, where `dedicated` counts each worker's
+    connections outside the pool; a quarter of each worker's pooled
+    share is kept as overflow for bursts.
+    """
+    share = (max_connections - reserved) // max(workers, 1) - dedicated
+    if share < 1:
+        raise ValueError(
+            f"{workers} workers cannot share {max_connections} connections "
+            f"({reserved} reserved); raise max_connections or run fewer workers"
+        )
+    pool_size = max(1, share * 3 // 4)
+    return pool_size, share - pool_size
+
+
+def pool_options_from_env():
+    """
+    Engine pool settings from the environment, plus the size of the
+    engine's compiled statement cache. Only variables that are set
+    are passed on, so SQLAlchemy's defaults apply otherwise; pre-ping is on
+    unless DB_POOL_PRE_PING=false. When DB_MAX_CONNECTIONS is set and the
+    pool size and overflow are not, the pool is sized so that WEB_CONCURRENCY workers
+    together, with their dedicated connections, stay under the limit (see
+    per_worker_pool).
+    """
+    options = {"pool_pre_ping": _env_flag("DB_POOL_PRE_PING", "true")}
+    for env_name, option, convert in (
+        ("DB_POOL_SIZE", "pool_size", int),
+        ("DB_MAX_OVERFLOW", "max_overflow", int),
+        ("DB_POOL_TIMEOUT", "pool_timeout", float),
+        ("DB_POOL_RECYCLE", "pool_recycle", int),
+        ("DB_STATEMENT_CACHE_SIZE", "query_cache_size", int),
+    ):
+        value = os.getenv(env_name)
+        if value:
+            try:
+                options[option] = convert(value)
+            except ValueError:
+                raise ValueError(f"{env_name} must be a number, got: {value}")
+
+    max_connections = os.getenv("DB_MAX_CONNECTIONS")
+    if max_connections and not {"pool_size", "max_overflow"} & options.keys():
+        try:
+            limits = [int(max_connections), int(os.getenv("WEB_CONCURRENCY") or 1),
+                      int(os.getenv("DB_RESERVED_CONNECTIONS") or DEFAULT_RESERVED_CONNECTIONS)]
+        except ValueError:
+            raise ValueError("DB_MAX_CONNECTIONS, WEB_CONCURRENCY and DB_RESERVED_CONNECTIONS must be numbers")
+        options["pool_size"], options["max_overflow"] = per_worker_pool(*limits, dedicated=dedicated_connections())
+    return options
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram (cumulative counts, like Prometheus)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {"buckets": cumulative, "count": count, "sum": total}
+
+
+class PoolMonitor:
+    """
+    Connection pool statistics for an engine: live checked-out/overflow
+    figures read from the pool, plus how long callers waited for a
+    connection and how often the pool timed out. Checkouts happen on many
+    threads at once, so the counters are updated under a lock.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.wait_seconds = Histogram(WAIT_BUCKETS)
+        self.checkouts = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+        self.wait_seconds.observe(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        pool = self.engine.pool
+        stats = {"pool": type(pool).__name__}
+        # Not every pool class (e.g. SQLite's) implements every counter.
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name.replace("checked", "checked_")] = method()
+        with self._lock:
+            stats["checkouts"], stats["timeouts"] = self.checkouts, self.timeouts
+        stats["wait_seconds"] = self.wait_seconds.snapshot()
+        return stats
@@ -0,0 +1,73 @@
+import os
+from datetime import datetime, timezone
+from sqlalchemy import Table, Column, DateTime, Identity, Integer, String, Text, Numeric, Index
+
+# Course ids are assigned by the database from an identity sequence, and
+# each session preallocates DB_ID_CACHE of them. A larger cache saves
+# sequence round trips on batch inserts, but ids skip values (a session's
+# unused ids are lost when it closes) and are only ordered per session.
+# It also breaks the guarantee that explicit ids are never generated again:
+# values a session already cached can't be moved past an explicit id (see
+# db.ops.advance_identity). The default of 1 keeps that guarantee;
+# nextval() holds no lock beyond the call, so inserts don't queue on it.
+ID_CACHE = int(os.getenv("DB_ID_CACHE", "1"))
+
+
+def items_table(metadata, name="items"):
+    return Table(
+        name, metadata,
+        # BY DEFAULT: explicit ids (imports, upserts) are still accepted.
+        Column("id", Integer, Identity(start=1, cache=ID_CACHE), primary_key=True),
+        Column("name", String(255), nullable=False),
+        Column("description", Text, nullable=False),
+        # Rows come back as floats, which is what the API models expect.
+        Column("price", Numeric(10, 2, asdecimal=False), nullable=False),
+        Index(f"ix_{name}_name", "name"),
+        Index(f"ix_{name}_price", "price"),
+    )
+
+
+def idempotency_keys_table(metadata, name="idempotency_keys"):
+    # Idempotency-Key values seen on POST requests, with a hash of the
+    # request they came with and the response that was returned for it.
+    return Table(
+        name, metadata,
+        Column("key", String(255), primary_key=True),
+        Column("fingerprint", String(64), nullable=False),
+        Column("response", Text),
+        Column("created_at", DateTime(timezone=True), nullable=False,
+               default=lambda: datetime.now(timezone.utc)),
+        Index(f"ix_{name}_created_at", "created_at"),
+    )
+
+
+# Full-text search (PostgreSQL only). Each searchable table gets a stored
+# generated tsvector column over `weights` (column -> rank weight, A is
+# highest) with a GIN index, plus pg_trgm GIN indexes on the `trigram`
+# columns for substring, prefix and typo-tolerant matching. The generated
+# column is not part of the Table definitions, so selects never return it.
+SEARCH_CONFIG = "english"
+SEARCH_VECTOR = "search_vector"
+SEARCHABLE = {
+    "items": {"weights": {"name": "A", "description": "B"}, "trigram": ("name",)},
+}
+
+
+# Change notifications (PostgreSQL only). Statement-level triggers on each
+# table NOTIFY its channel once per written row with a JSON payload
+# {"op": "insert"|"update"|"delete", "id": ..., "row": {...}}; the row
+# is omitted for deletes and for rows too large for a NOTIFY payload.
+# Statements writing more than NOTIFY_MAX_ROWS rows (bulk loads) send a
+# single {"op": "reset"} instead, telling listeners to reload.
+NOTIFY_CHANNELS = {
+    "items": "items_changes",
+}
+NOTIFY_MAX_ROWS = int(os.getenv("DB_NOTIFY_MAX_ROWS", "1000"))
+
+
+# Tables with a declared schema. SQLAlchemyOps builds these from the
+# definition instead of reflecting them, and can migrate legacy copies.
+TABLES = {
+    "items": items_table,
+    "idempotency_keys": idempotency_keys_table,
+}
@@ -49,26 +49,29 @@ def generate_curl_snippets():
                     "name": "Get All Courses",
                     "method": "GET", 
                     "endpoint": "/items/",
-                    "description": "Retrieve a list of all available courses",
+                    "description": "Retrieve a page of courses (use limit/after to paginate)",
                     "curl": f"""curl -X GET "{base_url}/items/" \\
   -H "Accept: application/json" \\
   -H "Content-Type: application/json" """,
                     "expected_response": {
                         "status_code": 200,
-                        "body": [
-                            {
-                                "id": 1,
-                                "name": "Python Programming",
-                                "description": "Learn Python from basics to advanced level",
-                                "price": 99.99
-                            },
-                            {
-                                "id": 2,
-                                "name": "Full Stack Web Development",
-                                "description": "Complete MERN stack development course",
-                                "price": 149.99
-                            }
-                        ]
+                        "body": {
+                            "items": [
+                                {
+                                    "id": 1,
+                                    "name": "Python Programming",
+                                    "description": "Learn Python from basics to advanced level",
+                                    "price": 99.99
+                                },
+                                {
+                                    "id": 2,
+                                    "name": "Full Stack Web Development",
+                                    "description": "Complete MERN stack development course",
+                                    "price": 149.99
+                                }
+                            ],
+                            "next_cursor": None
+                        }
                     }
                 },
                 {
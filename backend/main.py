@@ -1,8 +1,29 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from api import routes
+from api.health import router as health_router
+from api.metrics import MetricsMiddleware, router as metrics_router
 from api.routes import router
+from db.changes import start_change_feed, stop_change_feed
+from db.pool import dedicated_connections, pool_options_from_env
+from db.schema import NOTIFY_CHANNELS
 from openapi_config import custom_openapi
+import argparse
+import os
 import uvicorn
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect (and ensure the schema) in the background, so startup never
+    # waits on the database and an outage is retried instead of leaving
+    # the worker without a database until it is restarted.
+    await routes.database.start()
+    # One LISTEN connection per worker feeds GET /items/changes.
+    await start_change_feed(routes.changes, os.getenv("DATABASE_URL"), NOTIFY_CHANNELS["items"])
+    yield
+    await stop_change_feed(routes.changes)
+    await routes.database.stop()
+
 app = FastAPI(
     title="CRUD API Server",
     description="A FastAPI application for managing courses with full CRUD operations",
@@ -14,16 +35,73 @@ app = FastAPI(
     license_info={
         "name": "MIT",
     },
+    lifespan=lifespan,
 )
 
 # Set custom OpenAPI schema
 app.openapi = lambda: custom_openapi(app)
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router, prefix="/api/v1", tags=["courses"])
+app.include_router(health_router)
+app.include_router(metrics_router)
+
+def cpu_count():
+    # CPUs this process may run on, which respects container CPU sets.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def server_options(production, workers=None, host="0.0.0.0", port=8000):
+    """Keyword arguments for uvicorn.run in development or production mode."""
+    if not production:
+        return {"host": host, "port": port, "reload": True}
+    return {
+        "host": host,
+        "port": port,
+        "workers": workers or int(os.getenv("WEB_CONCURRENCY") or cpu_count()),
+        # "auto" picks uvloop and httptools when installed (pip install ".[prod]").
+        "loop": "auto",
+        "http": "auto",
+        # Longer than the usual load balancer idle timeout (60s), so the
+        # balancer, not the app, closes idle keep-alive connections.
+        "timeout_keep_alive": int(os.getenv("SERVER_KEEP_ALIVE", "65")),
+        "backlog": int(os.getenv("SERVER_BACKLOG", "2048")),
+        # On SIGTERM, stop accepting and give in-flight requests this long.
+        "timeout_graceful_shutdown": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),
+        "access_log": os.getenv("SERVER_ACCESS_LOG", "false").lower() in ("1", "true", "yes"),
+        "proxy_headers": True,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the CRUD API server")
+    parser.add_argument("--prod", action="store_true",
+                        help="production mode: several workers, no reloader (also APP_ENV=production)")
+    parser.add_argument("--workers", type=int,
+                        help="production worker processes (default: WEB_CONCURRENCY, else the CPU count)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    args = parser.parse_args(argv)
+
+    production = args.prod or os.getenv("APP_ENV", "").lower() == "production"
+    options = server_options(production, args.workers, args.host, args.port)
+    if production:
+        # Workers inherit the environment and size their pools from it.
+        os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+        pool = pool_options_from_env()
+        # The pool, plus the change feed's LISTEN connection.
+        per_worker = pool.get("pool_size", 5) + pool.get("max_overflow", 10) + dedicated_connections()
+        limit = os.getenv("DB_MAX_CONNECTIONS")
+        if limit and options["workers"] * per_worker > int(limit):
+            print(f"Warning: {options['workers']} workers x {per_worker} connections "
+                  f"exceeds DB_MAX_CONNECTIONS={limit}; unset DB_POOL_SIZE/DB_MAX_OVERFLOW "
+                  "to size pools automatically")
+        print(f"Starting {options['workers']} workers, up to {per_worker} database connections each")
 
-def main():
     print("Hello from crud-api-server-python!")
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", **options)
 
 if __name__ == "__main__":
     main()
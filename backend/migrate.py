@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Script to create or migrate tables to their declared schema.
+Missing tables are created, legacy tables (untyped columns, no primary key)
+are rebuilt in place with their rows preserved, and missing indexes are
+added. Nothing is dropped.
+Usage: python migrate.py [table ...]
+"""
+
+import os
+import sys
+from db.ops import SQLAlchemyOps
+from db.schema import TABLES
+
+def migrate(table_names):
+    """Ensure each named table is current, reporting what changed."""
+    db = SQLAlchemyOps(database_url=os.getenv("DATABASE_URL"))
+    try:
+        for table_name in table_names:
+            if table_name not in TABLES:
+                print(f"❌ No declared schema for '{table_name}'")
+                continue
+            if db.ensure_table(table_name):
+                print(f"✅ Brought '{table_name}' up to the declared schema")
+            else:
+                print(f"✔️  '{table_name}' is already up to date")
+    finally:
+        db.close_connection()
+
+if __name__ == "__main__":
+    migrate(sys.argv[1:] or list(TABLES))
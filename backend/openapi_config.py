@@ -255,20 +255,23 @@ def generate_curl_examples():
             "curl": f'''curl -X GET "{base_url}/items/" \\
   -H "Accept: application/json"
 ''',
-            "response": '''[
-  {
-    "id": 1,
-    "name": "Python Programming",
-    "description": "Learn Python from basics to advanced",
-    "price": 99.99
-  },
-  {
-    "id": 2,
-    "name": "Full Stack Web Development",
-    "description": "Complete MERN stack development course",
-    "price": 149.99
-  }
-]'''
+            "response": '''{
+  "items": [
+    {
+      "id": 1,
+      "name": "Python Programming",
+      "description": "Learn Python from basics to advanced",
+      "price": 99.99
+    },
+    {
+      "id": 2,
+      "name": "Full Stack Web Development",
+      "description": "Complete MERN stack development course",
+      "price": 149.99
+    }
+  ],
+  "next_cursor": null
+}'''
         },
         "update_course": {
             "description": "Update an existing course",
@@ -0,0 +1,34 @@
+import time
+import pytest
+from api import routes
+from db.cache import LRUCache, ReadThroughCache
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Give every test an empty read-through cache."""
+    cache = ReadThroughCache(LRUCache())
+    monkeypatch.setattr(routes, "cache", cache)
+    return cache
+
+
+@pytest.fixture
+def use_db():
+    """Serve the API from the given ops object, through dependency_overrides."""
+    def use(db):
+        app.dependency_overrides[routes.get_db] = lambda: db
+        return db
+    yield use
+    app.dependency_overrides.pop(routes.get_db, None)
+
+
+@pytest.fixture
+def wait_until_ready():
+    """Poll the readiness probe until the background connect has finished."""
+    def wait(client, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while client.get("/health/ready").status_code != 200:
+            assert time.monotonic() < deadline, "database never became ready"
+            time.sleep(0.01)
+    return wait
@@ -1,33 +1,458 @@
+import asyncio
+import csv
+import io
+import json
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from api import routes
+from db import ops
+from db.manager import DatabaseManager
+from db.ops import SQLAlchemyOps
 
 client = TestClient(app)
 
+
+@pytest.fixture(autouse=True)
+def sqlite_db(tmp_path, use_db):
+    db = use_db(SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'test.db'}"))
+    db.create_table("items")
+    yield db
+    db.close_connection()
+
+
 def test_crud_item():
     # Create
     data = {"id": 101, "name": "pytest", "description": "test desc", "price": 9.99}
-    resp = client.post("/items/", json=data)
-    assert resp.status_code == 200
+    resp = client.post("/api/v1/items/", json=data)
+    assert resp.status_code == 201
     assert resp.json()["message"] == "Course created successfully!"
 
     # Read
-    resp = client.get("/items/")
+    resp = client.get("/api/v1/items/")
     assert resp.status_code == 200
-    items = resp.json()
+    items = resp.json()["items"]
     assert any(item["id"] == 101 for item in items)
 
     # Update
     update = {"id": 101, "name": "pytest2", "description": "desc2", "price": 19.99}
-    resp = client.put("/items/101", json=update)
+    resp = client.put("/api/v1/items/101", json=update)
     assert resp.status_code == 200
     assert resp.json()["message"] == "Course updated successfully!"
 
     # Delete
-    resp = client.delete("/items/101")
+    resp = client.delete("/api/v1/items/101")
     assert resp.status_code == 200
     assert resp.json()["message"] == "Course deleted successfully!"
 
     # Confirm deletion
-    resp = client.get("/items/")
-    assert not any(item["id"] == 101 for item in resp.json())
+    resp = client.get("/api/v1/items/")
+    assert not any(item["id"] == 101 for item in resp.json()["items"])
+
+
+def test_list_items_keyset_pagination(sqlite_db):
+    for i in range(1, 6):
+        sqlite_db.insert_data("items", [i, f"course {i}", "desc", 10.0 * i])
+
+    resp = client.get("/api/v1/items/", params={"limit": 2})
+    page = resp.json()
+    assert [c["id"] for c in page["items"]] == [1, 2]
+    assert page["next_cursor"] == "2"
+
+    resp = client.get("/api/v1/items/", params={"limit": 2, "after": page["next_cursor"]})
+    page = resp.json()
+    assert [c["id"] for c in page["items"]] == [3, 4]
+
+    resp = client.get("/api/v1/items/", params={"limit": 2, "after": page["next_cursor"]})
+    page = resp.json()
+    assert [c["id"] for c in page["items"]] == [5]
+    assert page["next_cursor"] is None
+
+
+def test_list_items_filters(sqlite_db):
+    sqlite_db.insert_data("items", [1, "Python Programming", "desc", 9.5])
+    sqlite_db.insert_data("items", [2, "Advanced python", "desc", 100])
+    sqlite_db.insert_data("items", [3, "Rust", "desc", 50])
+
+    resp = client.get("/api/v1/items/", params={"name": "PYTHON"})
+    assert [c["id"] for c in resp.json()["items"]] == [1, 2]
+
+    resp = client.get("/api/v1/items/", params={"min_price": 10, "max_price": 60})
+    assert [c["id"] for c in resp.json()["items"]] == [3]
+
+
+def test_list_items_invalid_cursor():
+    resp = client.get("/api/v1/items/", params={"after": "nope"})
+    assert resp.status_code == 400
+
+
+def test_read_single_item(sqlite_db):
+    sqlite_db.insert_data("items", [7, "Go", "desc", 30])
+
+    resp = client.get("/api/v1/items/7")
+    assert resp.status_code == 200
+    assert resp.json() == {"id": 7, "name": "Go", "description": "desc", "price": 30.0}
+
+    resp = client.get("/api/v1/items/8")
+    assert resp.status_code == 404
+
+
+def test_update_missing_item_returns_404():
+    resp = client.put("/api/v1/items/999", json={"price": 5})
+    assert resp.status_code == 404
+
+
+def test_create_duplicate_id_conflicts():
+    data = {"id": 7, "name": "once", "description": "d", "price": 1.0}
+    assert client.post("/api/v1/items/", json=data).status_code == 201
+    resp = client.post("/api/v1/items/", json=data)
+    assert resp.status_code == 409 and "already exists" in resp.json()["detail"]
+
+
+def test_create_without_id_assigns_one(sqlite_db):
+    sqlite_db.insert_data("items", [40, "imported", "desc", 1.0])
+    course = {"name": "new", "description": "d", "price": 2.0}
+    resp = client.post("/api/v1/items/", json=course)
+    assert resp.status_code == 201
+    assert resp.json()["course"] == {"id": 41, **course}
+    assert client.get("/api/v1/items/41").json()["name"] == "new"
+
+    sqlite_db.create_table("idempotency_keys")
+    resp = client.post("/api/v1/items/", json=course, headers={"Idempotency-Key": "gen-1"})
+    created = resp.json()["course"]["id"]
+    assert created == 42
+    resp = client.post("/api/v1/items/", json=course, headers={"Idempotency-Key": "gen-1"})
+    assert resp.json()["course"]["id"] == created
+
+
+def test_put_upserts_full_course():
+    course = {"name": "synced", "description": "from a sync job", "price": 12.5}
+    resp = client.put("/api/v1/items/55", json=course)
+    assert resp.status_code == 201
+    assert resp.json()["course"] == {"id": 55, **course}
+
+    resp = client.put("/api/v1/items/55", json={**course, "price": 13.5})
+    assert resp.status_code == 200
+    assert client.get("/api/v1/items/55").json()["price"] == 13.5
+    # Partial bodies and conditional writes never create.
+    assert client.put("/api/v1/items/56", json={"name": "x"}).status_code == 404
+    assert client.put("/api/v1/items/56", json=course, headers={"If-Match": "*"}).status_code == 412
+
+
+def test_bulk_upsert(sqlite_db):
+    sqlite_db.insert_data("items", [1, "old", "desc", 1.0])
+    client.get("/api/v1/items/1")  # cached before the upsert
+    resp = client.put("/api/v1/items/bulk", json=[
+        {"id": 1, "name": "replaced", "description": "desc", "price": 2.0},
+        {"id": 2, "name": "new", "description": "desc", "price": 3.0},
+        {"id": 2, "name": "newer", "description": "desc", "price": 4.0},
+    ])
+    assert resp.status_code == 200 and resp.json()["affected"] == 2
+    assert client.get("/api/v1/items/1").json()["name"] == "replaced"
+    assert client.get("/api/v1/items/2").json()["name"] == "newer"
+
+
+def test_idempotent_create(sqlite_db):
+    sqlite_db.create_table("idempotency_keys")
+    data = {"id": 9, "name": "retry me", "description": "d", "price": 5.0}
+    headers = {"Idempotency-Key": "3f1c-retry"}
+
+    first = client.post("/api/v1/items/", json=data, headers=headers)
+    retry = client.post("/api/v1/items/", json=data, headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+    resp = client.post("/api/v1/items/", json={**data, "price": 6.0}, headers=headers)
+    assert resp.status_code == 422
+    # A failed create does not burn the key.
+    resp = client.post("/api/v1/items/", json=data, headers={"Idempotency-Key": "other"})
+    assert resp.status_code == 409
+    assert sqlite_db.fetch_one("idempotency_keys", "other", key="key") is None
+
+    assert sqlite_db.purge_idempotency_keys(3600) == 0
+    assert sqlite_db.purge_idempotency_keys(-1) == 1
+
+
+def test_startup_ensures_schema_without_dropping(tmp_path, monkeypatch, wait_until_ready):
+    db = SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'startup.db'}")
+    db.ensure_table("items")
+    db.insert_data("items", [1, "kept", "desc", 1.5])
+    monkeypatch.setattr(routes, "database", DatabaseManager(lambda: db, tables=["items"]))
+    app.dependency_overrides.clear()
+
+    with TestClient(app) as startup_client:
+        wait_until_ready(startup_client)
+        resp = startup_client.get("/api/v1/items/1")
+        assert resp.status_code == 200
+        assert resp.json()["name"] == "kept"
+
+
+def test_database_recovers_without_restart(tmp_path, monkeypatch, wait_until_ready):
+    attempts = []
+
+    def flaky_factory():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("database is starting up")
+        return SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'late.db'}")
+
+    monkeypatch.setattr(routes, "database", DatabaseManager(flaky_factory, tables=["items"], retry_initial=0.01))
+    app.dependency_overrides.clear()
+
+    with TestClient(app) as startup_client:
+        assert startup_client.get("/health/live").json() == {"status": "alive"}
+        wait_until_ready(startup_client)
+        ready = startup_client.get("/health/ready").json()
+        assert ready["state"] == "ready" and ready["failures"] == 2
+        assert startup_client.get("/api/v1/items/").json()["items"] == []
+
+    assert startup_client.get("/health/ready").status_code == 503
+    assert client.get("/api/v1/items/").status_code == 503
+
+
+def test_bulk_create_json_array_reports_bad_rows(sqlite_db):
+    sqlite_db.insert_data("items", [2, "existing", "desc", 1.0])
+    rows = [
+        {"id": 1, "name": "a", "description": "d", "price": 1.0},
+        {"id": 2, "name": "duplicate", "description": "d", "price": 1.0},
+        {"id": 3, "name": "b", "description": "d", "price": -1},
+        {"id": 4, "name": "c", "description": "d", "price": 4.0},
+    ]
+    resp = client.post("/api/v1/items/bulk", json=rows)
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["inserted"] == 2
+    assert [err["index"] for err in body["errors"]] == [1, 2]
+    assert sorted(c["id"] for c in sqlite_db.fetch_data("items")) == [1, 2, 4]
+
+
+def test_bulk_create_ndjson_stream(sqlite_db):
+    lines = [
+        '{"id": 1, "name": "a", "description": "d", "price": 1.0}',
+        'not json',
+        '{"id": 2, "name": "b", "description": "d", "price": 2.0}',
+    ]
+    resp = client.post(
+        "/api/v1/items/bulk",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 201
+    body = resp.json()
+    assert body["inserted"] == 2
+    assert body["failed"] == 1
+    assert body["errors"][0]["index"] == 1
+
+
+def test_bulk_create_reaches_copy_for_full_chunks(sqlite_db, monkeypatch, caplog):
+    # Pretend to be PostgreSQL/psycopg2 so bulk_insert considers COPY.
+    monkeypatch.setattr(sqlite_db.engine.dialect, "name", "postgresql")
+    monkeypatch.setattr(sqlite_db.engine.dialect, "driver", "psycopg2")
+    copied = []
+
+    def copy_insert(table_name, rows):
+        copied.append(len(rows))
+        raise RuntimeError("permission denied for table items")
+
+    monkeypatch.setattr(sqlite_db, "copy_insert", copy_insert)
+    count = ops.COPY_THRESHOLD + 1
+    lines = (json.dumps({"name": f"c{i}", "description": "d", "price": 1.0}) for i in range(count))
+    resp = client.post("/api/v1/items/bulk", content="\n".join(lines),
+                       headers={"Content-Type": "application/x-ndjson"})
+    assert resp.json()["inserted"] == count
+    # The full chunk goes to COPY; its failure is logged, then it falls back.
+    assert copied == [ops.COPY_THRESHOLD]
+    assert "permission denied" in caplog.text
+
+
+def test_bulk_create_mixes_explicit_and_generated_ids(sqlite_db):
+    rows = [
+        {"id": 10, "name": "a", "description": "d", "price": 1.0},
+        {"name": "b", "description": "d", "price": 2.0},
+        {"id": 10, "name": "duplicate", "description": "d", "price": 3.0},
+        {"name": "c", "description": "d", "price": 4.0},
+    ]
+    body = client.post("/api/v1/items/bulk", json=rows).json()
+    assert body["inserted"] == 3
+    assert [err["index"] for err in body["errors"]] == [2]
+    stored = {c["name"]: c["id"] for c in sqlite_db.fetch_data("items")}
+    assert stored["a"] == 10 and len(set(stored.values())) == 3
+
+
+def test_conditional_get(sqlite_db):
+    sqlite_db.insert_data("items", [1, "Go", "desc", 30])
+
+    resp = client.get("/api/v1/items/")
+    etag = resp.headers["etag"]
+    resp = client.get("/api/v1/items/", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+    resp = client.get("/api/v1/items/1")
+    item_etag = resp.headers["etag"]
+    assert client.get("/api/v1/items/1", headers={"If-None-Match": f"W/{item_etag}"}).status_code == 304
+
+    client.put("/api/v1/items/1", json={"price": 31})
+    assert client.get("/api/v1/items/", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/api/v1/items/1", headers={"If-None-Match": item_etag}).status_code == 200
+
+
+def test_if_match_guards_writes(sqlite_db):
+    sqlite_db.insert_data("items", [1, "Go", "desc", 30])
+    etag = client.get("/api/v1/items/1").headers["etag"]
+
+    resp = client.put("/api/v1/items/1", json={"price": 31}, headers={"If-Match": etag})
+    assert resp.status_code == 200
+    new_etag = resp.headers["etag"]
+    assert new_etag != etag
+
+    # A second writer still holding the old ETag loses.
+    resp = client.put("/api/v1/items/1", json={"price": 32}, headers={"If-Match": etag})
+    assert resp.status_code == 412
+    assert client.delete("/api/v1/items/1", headers={"If-Match": etag}).status_code == 412
+
+    assert client.delete("/api/v1/items/1", headers={"If-Match": new_etag}).status_code == 200
+    assert client.get("/api/v1/items/1").status_code == 404
+
+
+def test_fast_json_matches_model_response(sqlite_db, monkeypatch):
+    from api import fast_json
+    for i in range(1, 4):
+        sqlite_db.insert_data("items", [i, f"course {i}", "desc", 10.5 * i])
+
+    slow_list = client.get("/api/v1/items/", params={"limit": 2})
+    slow_item = client.get("/api/v1/items/2")
+    monkeypatch.setattr(fast_json, "FAST_JSON", True)
+    asyncio.run(routes.cache.invalidate_rows("items", 2))
+    fast_list = client.get("/api/v1/items/", params={"limit": 2})
+    fast_item = client.get("/api/v1/items/2")
+
+    assert fast_list.headers["content-type"] == "application/json"
+    assert fast_list.json() == slow_list.json()
+    assert fast_list.headers["etag"] == slow_list.headers["etag"]
+    assert fast_item.json() == slow_item.json()
+
+
+def test_export_ndjson_and_csv(sqlite_db):
+    for i in range(1, 4):
+        sqlite_db.insert_data("items", [i, f"course, {i}", "desc", 10.5 * i])
+
+    resp = client.get("/api/v1/items/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert rows == client.get("/api/v1/items/").json()["items"]
+
+    resp = client.get("/api/v1/items/export", params={"format": "csv", "min_price": 20})
+    assert resp.headers["content-type"].startswith("text/csv")
+    assert 'filename="items.csv"' in resp.headers["content-disposition"]
+    assert list(csv.reader(io.StringIO(resp.text))) == [
+        ["id", "name", "description", "price"],
+        ["2", "course, 2", "desc", "21"],
+        ["3", "course, 3", "desc", "31.5"],
+    ]
+    assert client.get("/api/v1/items/export", params={"format": "xml"}).status_code == 422
+
+
+def test_bulk_update_and_delete(sqlite_db):
+    for i in range(1, 6):
+        sqlite_db.insert_data("items", [i, f"course {i}", "desc", 10.0 * i])
+    client.get("/api/v1/items/1")  # cached before the bulk write
+
+    resp = client.patch("/api/v1/items/bulk", json={"ids": [1, 2, 99], "values": {"price": 5.0}})
+    assert resp.json()["affected"] == 2
+    assert client.get("/api/v1/items/1").json()["price"] == 5.0
+
+    resp = client.patch("/api/v1/items/bulk", json={"items": [
+        {"id": 3, "price": 33.0}, {"id": 4, "name": "renamed"}, {"id": 98, "price": 1.0},
+    ]})
+    assert resp.json()["affected"] == 2
+    assert client.get("/api/v1/items/4").json()["name"] == "renamed"
+
+    resp = client.request("DELETE", "/api/v1/items/bulk", json={"filter": {"max_price": 10}})
+    assert resp.json()["affected"] == 2
+    remaining = [item["id"] for item in client.get("/api/v1/items/").json()["items"]]
+    assert remaining == [3, 4, 5]
+
+
+def test_bulk_writes_require_a_selection(sqlite_db):
+    assert client.patch("/api/v1/items/bulk", json={"values": {"price": 1.0}}).status_code == 400
+    assert client.patch("/api/v1/items/bulk", json={"ids": [1], "values": {}}).status_code == 400
+    assert client.request("DELETE", "/api/v1/items/bulk", json={"filter": {}}).status_code == 400
+
+
+def test_list_items_sorted(sqlite_db):
+    prices = {1: 30.0, 2: 10.0, 3: 20.0, 4: 10.0, 5: 40.0}
+    for i, price in prices.items():
+        sqlite_db.insert_data("items", [i, f"course {6 - i}", "desc", price])
+
+    def walk(sort, limit=2):
+        ids, after = [], None
+        while True:
+            params = {"sort": sort, "limit": limit, **({"after": after} if after else {})}
+            page = client.get("/api/v1/items/", params=params).json()
+            ids += [item["id"] for item in page["items"]]
+            after = page["next_cursor"]
+            if after is None:
+                return ids
+
+    # Equal prices are ordered by id, in the same direction as the sort.
+    assert walk("price") == [2, 4, 3, 1, 5]
+    assert walk("-price") == [5, 1, 3, 4, 2]
+    assert walk("name") == [5, 4, 3, 2, 1]
+    assert walk("-id", limit=3) == [5, 4, 3, 2, 1]
+
+    assert client.get("/api/v1/items/", params={"sort": "description"}).status_code == 400
+    cursor = client.get("/api/v1/items/", params={"sort": "price", "limit": 1}).json()["next_cursor"]
+    assert client.get("/api/v1/items/", params={"sort": "-price", "after": cursor}).status_code == 400
+    assert client.get("/api/v1/items/", params={"sort": "price", "after": "2"}).status_code == 400
+
+
+def test_item_stats(sqlite_db):
+    assert client.get("/api/v1/items/stats").json() == {
+        "count": 0, "min_price": None, "max_price": None, "avg_price": None, "total_price": None,
+    }
+    for i, price in enumerate([10.0, 20.0, 40.0], start=1):
+        sqlite_db.insert_data("items", [i, f"course {i}", "desc", price])
+
+    # Cached until the next write through the API.
+    assert client.get("/api/v1/items/stats").json()["count"] == 0
+    client.delete("/api/v1/items/3")
+    assert client.get("/api/v1/items/stats").json() == {
+        "count": 2, "min_price": 10.0, "max_price": 20.0, "avg_price": 15.0, "total_price": 30.0,
+    }
+    assert client.get("/api/v1/items/stats", params={"min_price": 15}).json()["count"] == 1
+
+
+def test_search_items(sqlite_db):
+    sqlite_db.insert_data("items", [1, "Web Development", "Build sites with Python and Django", 50.0])
+    sqlite_db.insert_data("items", [2, "Python Programming", "From basics to advanced", 40.0])
+    sqlite_db.insert_data("items", [3, "Data Science", "Statistics with R", 60.0])
+
+    resp = client.get("/api/v1/items/search", params={"q": "python"})
+    assert resp.status_code == 200
+    # Name matches rank above description matches.
+    assert [item["id"] for item in resp.json()["items"]] == [2, 1]
+    assert resp.json()["items"][0]["rank"] > resp.json()["items"][1]["rank"]
+
+    assert [item["id"] for item in client.get("/api/v1/items/search", params={"q": "python django"}).json()["items"]] == [1]
+    assert client.get("/api/v1/items/search", params={"q": "python", "limit": 1}).json()["items"][0]["id"] == 2
+
+    # Cached results are dropped by writes.
+    client.put("/api/v1/items/3", json={"name": "Python for Data Science"})
+    assert len(client.get("/api/v1/items/search", params={"q": "python"}).json()["items"]) == 3
+
+    assert client.get("/api/v1/items/search", params={"q": "   "}).status_code == 400
+    assert client.get("/api/v1/items/search").status_code == 422
+
+
+def test_server_options_for_production(monkeypatch):
+    from main import server_options
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert server_options(False) == {"host": "0.0.0.0", "port": 8000, "reload": True}
+    options = server_options(True)
+    assert options["workers"] == 3 and "reload" not in options
+    assert options["timeout_graceful_shutdown"] == 30
+    assert server_options(True, workers=5)["workers"] == 5
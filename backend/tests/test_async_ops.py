@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("greenlet")
+pytest.importorskip("aiosqlite")
+
+from db.async_ops import AsyncSQLAlchemyOps, to_async_url
+from db.manager import DatabaseManager
+from main import app
+from api import routes
+
+
+def test_to_async_url():
+    assert str(to_async_url("sqlite:///app.db")) == "sqlite+aiosqlite:///app.db"
+    assert to_async_url("postgresql+psycopg2://u:p@h:5432/d").drivername == "postgresql+asyncpg"
+    assert to_async_url("postgres://u:p@h:5432/d").drivername == "postgresql+asyncpg"
+
+
+def test_async_crud(tmp_path):
+    async def scenario():
+        db = AsyncSQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'async.db'}")
+        assert await db.ensure_table("items") is True
+        await db.insert_data("items", [1, "Python", "desc", 10.0])
+        inserted, errors = await db.bulk_insert("items", [
+            {"id": 2, "name": "Go", "description": "desc", "price": 20.0},
+            {"id": 1, "name": "dup", "description": "desc", "price": 1.0},
+        ])
+        assert (inserted, [index for index, _ in errors]) == (1, [1])
+
+        rows, next_id = await db.fetch_page("items", 1)
+        assert [r["id"] for r in rows] == [1] and next_id == 1
+        updated = await db.update_returning("items", {"price": 15.0}, {"id": 1})
+        assert updated[0]["price"] == 15.0
+        assert await db.update_many("items", [{"id": 1, "price": 16.0}, {"id": 2, "name": "Go 2"}]) == 2
+        assert await db.update_where("items", {"price": 21.0}, {"id__in": [2]}) == [2]
+        assert await db.delete_where("items", {"price__gte": 21}) == [2]
+        assert await db.delete_data("items", {"id": 2}) == 0
+        assert await db.fetch_one("items", 2) is None
+        batches = [batch async for batch in db.iter_data("items", batch_size=1)]
+        assert [[r["id"] for r in batch] for batch in batches] == [[1]]
+        await db.close_connection()
+
+    asyncio.run(scenario())
+
+
+def test_routes_with_async_ops(tmp_path, monkeypatch, wait_until_ready):
+    db = AsyncSQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'api.db'}")
+    monkeypatch.setattr(routes, "database", DatabaseManager(lambda: db, tables=["items"]))
+
+    with TestClient(app) as client:
+        wait_until_ready(client)
+        data = {"id": 1, "name": "async", "description": "desc", "price": 5.0}
+        assert client.post("/api/v1/items/", json=data).status_code == 201
+        assert client.get("/api/v1/items/1").json()["name"] == "async"
+        assert client.get("/api/v1/items/export", params={"format": "csv"}).text.splitlines()[1] == "1,async,desc,5"
+        resp = client.put("/api/v1/items/1", json={"price": 6.0})
+        assert resp.json()["course"]["price"] == 6.0
+        assert client.delete("/api/v1/items/1").status_code == 200
+        assert client.get("/api/v1/items/").json()["items"] == []
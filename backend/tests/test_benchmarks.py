@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("httpx")
+
+from benchmarks.compare import compare
+from benchmarks.load import percentile, summarize
+
+
+def test_percentile_and_summary():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([], 50) is None
+    summary = summarize(values, errors=2, elapsed=2.0)
+    assert summary["requests"] == 102 and summary["rps"] == 51.0
+    assert summary["p95_ms"] == 95.0
+
+
+def test_compare_flags_regressions():
+    baseline = {"results": {"read": {"rps": 1000, "p50_ms": 2.0, "p95_ms": 5.0, "p99_ms": 9.0}}}
+    current = {"results": {"read": {"rps": 850, "p50_ms": 2.1, "p95_ms": 6.0, "p99_ms": 9.0}}}
+    regressed = {metric for _, metric, *_, flag in compare(baseline, current, 10) if flag}
+    assert regressed == {"rps", "p95_ms"}
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from api import routes
+from db.cache import MISSING, LRUCache, RedisCache, ReadThroughCache, cache_from_env
+from db.ops import SQLAlchemyOps
+
+
+class FakeRedis:
+    """Local stand-in for a Redis server (the subset RedisCache uses)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def test_lru_cache_evicts_and_expires():
+    cache = LRUCache(max_entries=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is MISSING
+
+
+def test_redis_cache_round_trip():
+    cache = RedisCache(client=FakeRedis())
+    cache.set("k", {"items": [1, 2]})
+    assert cache.get("k") == {"items": [1, 2]}
+    assert cache.add("k", 1) is False
+    cache.delete("k")
+    assert cache.get("k") is MISSING
+
+
+def test_concurrent_misses_are_coalesced():
+    cache = ReadThroughCache(LRUCache())
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+    assert results == [{"id": 1}] * 10
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 0, "misses": 1, "coalesced": 9}
+
+
+def test_load_overlapping_a_write_is_not_cached():
+    cache = ReadThroughCache(LRUCache())
+    rows = {1: {"id": 1, "price": 1.0}}
+    key = cache.row_key("items", 1)
+
+    async def scenario():
+        read_done = asyncio.Event()
+        write_done = asyncio.Event()
+
+        async def slow_loader():
+            row = dict(rows[1])  # read before the write commits
+            read_done.set()
+            await write_done.wait()
+            return row
+
+        async def write():
+            await read_done.wait()
+            rows[1]["price"] = 2.0
+            await cache.invalidate_rows("items", 1)
+            write_done.set()
+
+        stale, _ = await asyncio.gather(cache.get_or_load(key, slow_loader), write())
+        fresh = await cache.get_or_load(key, lambda: asyncio.sleep(0, dict(rows[1])))
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale["price"] == 1.0
+    assert fresh["price"] == 2.0
+    assert cache.stats()["misses"] == 2
+
+
+def test_invalidation_changes_list_keys():
+    cache = ReadThroughCache(RedisCache(client=FakeRedis()))
+
+    async def scenario():
+        key = await cache.list_key("items", limit=10)
+        assert await cache.list_key("items", limit=10) == key
+        await cache.invalidate_lists("items")
+        assert await cache.list_key("items", limit=10) != key
+
+    asyncio.run(scenario())
+
+
+def test_redis_calls_run_off_the_event_loop():
+    server = FakeRedis()
+    callers = set()
+    for name in ("get", "set", "delete"):
+        def traced(*args, _call=getattr(server, name), **kwargs):
+            callers.add(threading.get_ident())
+            return _call(*args, **kwargs)
+        setattr(server, name, traced)
+    cache = ReadThroughCache(RedisCache(client=server))
+
+    async def scenario():
+        key = await cache.list_key("items", limit=10)
+        await cache.get_or_load(key, lambda: asyncio.sleep(0, []))
+        await cache.get_or_load(cache.row_key("items", 1), lambda: asyncio.sleep(0, {"id": 1}))
+        await cache.invalidate_rows("items", 1)
+
+    asyncio.run(scenario())
+    assert callers and threading.get_ident() not in callers
+
+
+def test_writes_through_one_worker_are_seen_by_another():
+    # Two workers, each with its own cache object, sharing one Redis.
+    server = FakeRedis()
+    first = ReadThroughCache(RedisCache(client=server))
+    second = ReadThroughCache(RedisCache(client=server))
+    rows = {1: {"id": 1, "price": 1.0}}
+
+    async def read(cache):
+        row = await cache.get_or_load(cache.row_key("items", 1), lambda: asyncio.sleep(0, dict(rows[1])))
+        page = await cache.get_or_load(await cache.list_key("items", limit=10), lambda: asyncio.sleep(0, [dict(rows[1])]))
+        return row["price"], page[0]["price"]
+
+    assert asyncio.run(read(first)) == (1.0, 1.0)
+    assert asyncio.run(read(second)) == (1.0, 1.0)
+    rows[1]["price"] = 2.0
+    asyncio.run(first.invalidate_rows("items", 1))
+    assert asyncio.run(read(second)) == (2.0, 2.0)
+
+
+def test_memory_cache_is_refused_with_several_workers(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    assert isinstance(cache_from_env().backend, LRUCache)
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(ValueError, match="CACHE_BACKEND=redis"):
+        cache_from_env()
+
+
+def test_reads_are_cached_and_writes_invalidate(tmp_path, use_db, fresh_cache):
+    db = use_db(SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'cache.db'}"))
+    db.ensure_table("items")
+    client = TestClient(app)
+
+    client.post("/api/v1/items/", json={"id": 1, "name": "a", "description": "d", "price": 1.0})
+    assert client.get("/api/v1/items/").json()["items"][0]["price"] == 1.0
+    assert client.get("/api/v1/items/1").json()["price"] == 1.0
+    assert client.get("/api/v1/items/").status_code == 200
+    assert client.get("/api/v1/items/1").status_code == 200
+    assert fresh_cache.hits == 2
+
+    client.put("/api/v1/items/1", json={"price": 2.0})
+    assert client.get("/api/v1/items/").json()["items"][0]["price"] == 2.0
+    assert client.get("/api/v1/items/1").json()["price"] == 2.0
+
+    client.delete("/api/v1/items/1")
+    assert client.get("/api/v1/items/").json()["items"] == []
+    assert client.get("/api/v1/items/1").status_code == 404
+    db.close_connection()
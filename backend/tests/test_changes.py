@@ -0,0 +1,107 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from api import routes
+from db.changes import RESET, ChangeFeed
+from db.ops import SQLAlchemyOps
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    feed = ChangeFeed(buffer_size=10, queue_size=3)
+    monkeypatch.setattr(routes, "changes", feed)
+    return feed
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, use_db):
+    db = use_db(SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'test.db'}"))
+    db.create_table("items")
+    yield db
+    db.close_connection()
+
+
+def read_stream(params=None, headers=None):
+    # (event, id, data) of each SSE event; the feed must be closed so the
+    # stream ends after its backlog.
+    resp = client.get("/api/v1/items/changes", params=params, headers=headers)
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in resp.text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], fields["id"], json.loads(fields["data"])))
+    return events
+
+
+def test_feed_resumes_from_token_or_resets():
+    feed = ChangeFeed(buffer_size=3)
+    for i in range(1, 6):
+        feed.publish({"op": "update", "id": i})
+
+    _, backlog = feed.subscribe(feed.token(3))
+    assert [change["id"] for _, change in backlog] == [4, 5]
+    # Expired, foreign and malformed tokens can't be resumed.
+    for token in (feed.token(1), "other:4", "garbage", feed.token(9)):
+        _, backlog = feed.subscribe(token)
+        assert backlog == [(feed.token(5), RESET)]
+    _, backlog = feed.subscribe()
+    assert backlog == []
+
+
+def test_slow_subscriber_is_dropped_without_blocking_others():
+    async def scenario():
+        feed = ChangeFeed(queue_size=2)
+        slow, _ = feed.subscribe()
+        fast, _ = feed.subscribe()
+        received = []
+
+        async def consume():
+            async for token, change in feed.events(fast, keepalive=1):
+                received.append(change["id"])
+                if len(received) == 3:
+                    return
+
+        consumer = asyncio.create_task(consume())
+        for i in range(1, 4):
+            feed.publish({"op": "insert", "id": i})
+            await asyncio.sleep(0)
+        await consumer
+        # The slow one still gets what it queued, then its stream ends.
+        queued = [change["id"] async for _, change in feed.events(slow)]
+        return received, queued, feed.stats()
+
+    received, queued, stats = asyncio.run(scenario())
+    assert received == [1, 2, 3]
+    assert queued == [1, 2]
+    assert stats["overflows"] == 1 and stats["subscribers"] == 1
+
+
+def test_change_stream_reports_writes(feed, sqlite_db):
+    start = feed.token(0)
+    client.post("/api/v1/items/", json={"name": "a", "description": "d", "price": 1.0})
+    client.put("/api/v1/items/1", json={"price": 2.0})
+    client.delete("/api/v1/items/1")
+    client.post("/api/v1/items/bulk", json=[{"name": "b", "description": "d", "price": 1.0}])
+    feed.close()
+
+    events = read_stream(headers={"Last-Event-ID": start})
+    assert [(event, change["op"], change.get("id")) for event, _, change in events] == [
+        ("change", "insert", 1), ("change", "update", 1), ("change", "delete", 1), ("reset", "reset", None),
+    ]
+    assert events[1][2]["row"] == {"id": 1, "name": "a", "description": "d", "price": 2.0}
+    # Resuming from an event's id skips everything up to it.
+    assert [change["op"] for _, _, change in read_stream(params={"resume": events[1][1]})] == ["delete", "reset"]
+    assert read_stream(params={"resume": "elsewhere:2"})[0][0] == "reset"
+
+
+def test_change_stream_over_websocket(feed):
+    feed.publish({"op": "delete", "id": 5})
+    feed.close()
+    with client.websocket_connect(f"/api/v1/items/changes/ws?resume={feed.token(0)}") as ws:
+        assert ws.receive_json() == {"token": feed.token(1), "op": "delete", "id": 5}
+        assert ws.receive()["code"] == 1013
@@ -0,0 +1,201 @@
+"""
+Micro-benchmarks for SQLAlchemyOps, run only with RUN_BENCHMARKS=1:
+
+    RUN_BENCHMARKS=1 pytest tests/test_db_benchmarks.py -s
+
+Each case is timed in BENCH_REPEAT samples (default 5). A sample repeats
+the call enough times to last at least BENCH_MIN_SAMPLE_MS (default 10 ms),
+calibrated once per case, so fast calls aren't lost in timer resolution and
+scheduler noise; the case's time is the median per call. Its peak
+allocation is measured with tracemalloc in one extra run.
+
+Results are compared with the stored baseline, and a case fails when it is
+more than BENCH_TOLERANCE (default 1.0, i.e. 100%) plus BENCH_NOISE_FLOOR_US
+(default 20 microseconds) slower per call, or allocates that much more.
+A case that comes out too slow is re-measured up to BENCH_RETRIES times
+(default 2) and fails only if every attempt is too slow, so one noisy
+run (another process, a frequency change) doesn't fail CI.
+Cases missing from the baseline are recorded; BENCH_UPDATE_BASELINE=1
+rewrites it with the current run. Baselines are machine-specific, so the
+baseline lives in pytest's cache directory (.pytest_cache) unless
+BENCH_BASELINE names a file, e.g. one kept per CI runner.
+
+SQLite in-memory always runs; set BENCH_DATABASE_URL to also benchmark a
+PostgreSQL database (a bench_items table is created and dropped there).
+"""
+import gc
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+import pytest
+from db.ops import SQLAlchemyOps
+from db.schema import items_table
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("RUN_BENCHMARKS", "").lower() not in ("1", "true", "yes"),
+    reason="set RUN_BENCHMARKS=1 to run the micro-benchmarks",
+)
+
+TABLE = "bench_items"
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "100,1000,10000").split(",")]
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+MIN_SAMPLE = float(os.getenv("BENCH_MIN_SAMPLE_MS", "10")) / 1e3
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "1.0"))
+NOISE_FLOOR = float(os.getenv("BENCH_NOISE_FLOOR_US", "20")) / 1e6
+RETRIES = int(os.getenv("BENCH_RETRIES", "2"))
+UPDATE_BASELINE = os.getenv("BENCH_UPDATE_BASELINE", "").lower() in ("1", "true", "yes")
+
+BACKENDS = {"sqlite": "sqlite://"}
+if os.getenv("BENCH_DATABASE_URL"):
+    BACKENDS["postgresql"] = os.getenv("BENCH_DATABASE_URL")
+
+
+def make_rows(count, start=0):
+    return [
+        {"id": i, "name": f"course {i}", "description": "benchmark row", "price": float(i % 500) + 0.99}
+        for i in range(start, start + count)
+    ]
+
+
+def baseline_path(config):
+    if os.getenv("BENCH_BASELINE"):
+        return Path(os.getenv("BENCH_BASELINE"))
+    cache = getattr(config, "cache", None)  # None with -p no:cacheprovider
+    return cache.mkdir("db_benchmarks") / "baseline.json" if cache is not None else None
+
+
+@pytest.fixture(scope="module")
+def baseline(request):
+    path = baseline_path(request.config)
+    stored = json.loads(path.read_text()) if path is not None and path.exists() else {}
+    current = {}
+    yield stored, current
+    if path is not None and (UPDATE_BASELINE or any(name not in stored for name in current)):
+        merged = current if UPDATE_BASELINE else {**current, **stored}
+        path.write_text(json.dumps(merged, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture(scope="module", params=list(BACKENDS))
+def bench_db(request):
+    db = SQLAlchemyOps(database_url=BACKENDS[request.param])
+    table = items_table(db.metadata, TABLE)
+    table.drop(db.engine, checkfirst=True)
+    table.create(db.engine)
+    yield db
+    table.drop(db.engine, checkfirst=True)
+    db.close_connection()
+
+
+def reset_table(db, rows=()):
+    db.delete_data(TABLE, {"id__gte": 0})
+    if rows:
+        db.bulk_insert(TABLE, list(rows))
+
+
+@pytest.fixture
+def bench(bench_db, baseline):
+    """Time func (after setup) and check it against the stored baseline."""
+    stored, current = baseline
+
+    def sample(loops, func, setup):
+        # Seconds spent in `loops` calls; setup runs untimed before each.
+        # Like timeit, with the garbage collector off: when its collections
+        # fall depends on everything allocated before, not on the code timed.
+        gc.collect()
+        gc.disable()
+        try:
+            if setup is None:
+                start = time.perf_counter()
+                for _ in range(loops):
+                    func()
+                return time.perf_counter() - start
+            elapsed = 0.0
+            for _ in range(loops):
+                setup()
+                start = time.perf_counter()
+                func()
+                elapsed += time.perf_counter() - start
+            return elapsed
+        finally:
+            gc.enable()
+
+    def run(name, func, setup=None):
+        key = f"{bench_db.engine.dialect.name}/{name}"
+        loops = 1
+        while (elapsed := sample(loops, func, setup)) < MIN_SAMPLE:
+            # Aim a little past the minimum; at most 10x more per round.
+            loops = max(loops + 1, min(loops * 10, int(loops * MIN_SAMPLE * 1.2 / max(elapsed, 1e-9))))
+        timings = [elapsed / loops] + [sample(loops, func, setup) / loops for _ in range(REPEAT - 1)]
+        seconds = statistics.median(timings)
+        previous = stored.get(key) if not UPDATE_BASELINE else None
+        allowed = previous["seconds"] * (1 + TOLERANCE) + NOISE_FLOOR if previous else None
+        for _ in range(RETRIES):
+            if allowed is None or seconds <= allowed:
+                break
+            # Too slow: a regression shows up again, noise usually doesn't.
+            seconds = min(seconds, statistics.median(sample(loops, func, setup) / loops for _ in range(REPEAT)))
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        result = {"seconds": seconds, "loops": loops, "peak_bytes": peak}
+        current[key] = result
+        print(f"\n  {key:<45} {result['seconds'] * 1e3:10.3f} ms/call x{loops:<6} {peak / 1024:10.1f} KiB")
+        if previous:
+            assert result["seconds"] <= allowed, (
+                f"{key} took {result['seconds']:.6f}s per call in {RETRIES + 1} attempts, "
+                f"baseline {previous['seconds']:.6f}s"
+            )
+            # Small absolute slack: tiny cases allocate a few KiB either way.
+            assert result["peak_bytes"] <= previous["peak_bytes"] * (1 + TOLERANCE) + 64 * 1024, (
+                f"{key} peaked at {result['peak_bytes']} bytes, baseline {previous['peak_bytes']}"
+            )
+        return result
+
+    return run
+
+
+def test_get_table(bench_db, bench):
+    bench("get_table/cached", lambda: [bench_db.get_table(TABLE) for _ in range(1000)])
+
+    def reflect():
+        bench_db.invalidate_table(TABLE)
+        bench_db.get_table(TABLE)
+
+    bench("get_table/reflect", reflect)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_inserts(bench_db, bench, size):
+    rows = make_rows(size)
+    if size <= 1000:
+        # Row-at-a-time inserts are only run for the smaller sizes.
+        bench(f"insert_data/{size}", lambda: [
+            bench_db.insert_data(TABLE, [r["id"], r["name"], r["description"], r["price"]]) for r in rows
+        ], setup=lambda: reset_table(bench_db))
+    bench(f"bulk_insert/{size}", lambda: bench_db.bulk_insert(TABLE, rows), setup=lambda: reset_table(bench_db))
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_reads(bench_db, bench, size):
+    reset_table(bench_db, make_rows(size))
+    bench(f"fetch_data/{size}", lambda: bench_db.fetch_data(TABLE))
+    bench(f"iter_data/{size}", lambda: [row for batch in bench_db.iter_data(TABLE) for row in batch])
+    bench(f"fetch_page/{size}", lambda: bench_db.fetch_page(TABLE, 100, after=size // 2))
+    bench(f"fetch_one/{size}", lambda: [bench_db.fetch_one(TABLE, i) for i in range(0, size, max(size // 100, 1))])
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_updates(bench_db, bench, size):
+    reset_table(bench_db, make_rows(size))
+    bench(f"update_where/{size}", lambda: bench_db.update_where(TABLE, {"price": 1.0}, {"id__gte": 0}))
+    per_row = [{"id": i, "price": 2.0} for i in range(size)]
+    bench(f"update_many/{size}", lambda: bench_db.update_many(TABLE, per_row))
@@ -27,3 +27,24 @@ def test_delete_data(db_ops):
     db_ops.delete_data('test_table', {'id': 3})
     result = db_ops.fetch_data('test_table')
     assert result == []
+
+@pytest.fixture(scope="function")
+def search_ops():
+    db = SQLAlchemyOps()
+    db.create_table('items')
+    db.insert_data('items', [1, 'Python Programming', 'From basics to advanced', 40.0])
+    db.insert_data('items', [2, 'Web Development', 'Build sites with Python and Django', 50.0])
+    db.insert_data('items', [3, 'Data Science', 'Statistics and programs in R', 60.0])
+    yield db
+    db.close_connection()
+
+def test_search_ranks_and_stems(search_ops):
+    # "programs" stems to the same lexeme as "Programming"; name beats description.
+    assert [row['id'] for row in search_ops.search('items', 'programs')] == [1, 3]
+    assert [row['id'] for row in search_ops.search('items', 'python')] == [1, 2]
+    assert search_ops.search('items', 'python -django')[0]['id'] == 1
+
+def test_search_trigram_fallback(search_ops):
+    # Prefixes and typos are missed by full-text search, found by pg_trgm.
+    assert search_ops.search('items', 'pyth')[0]['id'] == 1
+    assert search_ops.search('items', 'pythn')[0]['id'] == 1
@@ -0,0 +1,119 @@
+import logging
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from api import metrics, routes
+from db import instrument
+from db.changes import ChangeFeed
+from db.ops import SQLAlchemyOps
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(tmp_path, monkeypatch, use_db):
+    db = use_db(SQLAlchemyOps(database_url=f"sqlite:///{tmp_path / 'test.db'}"))
+    db.create_table("items")
+    monkeypatch.setattr(metrics, "METRICS", metrics.RequestMetrics())
+    # The middleware instance keeps its own reference.
+    monkeypatch.setattr(app, "middleware_stack", None)
+    yield db
+    db.close_connection()
+
+
+def sample(text, prefix):
+    for line in text.splitlines():
+        # Older FastAPI versions report routes with the router prefix.
+        if line.replace('route="/api/v1/', 'route="/').startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"no sample starting with {prefix}")
+
+
+def test_metrics_report_requests_and_queries():
+    client.post("/api/v1/items/", json={"id": 1, "name": "a", "description": "d", "price": 1.0})
+    client.get("/api/v1/items/1")
+    client.get("/api/v1/items/1")  # served from the cache: no query
+    client.get("/no-such-route")
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    assert sample(text, 'http_requests_total{method="GET",route="unmatched",status="404"}') == 1
+    assert sample(text, 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"') == 2
+    assert sample(text, 'http_request_db_queries_sum{method="GET",route="/items/{item_id}"') == 1
+    assert sample(text, 'http_request_db_queries_bucket{method="POST",route="/items/",le="1"}') == 1
+    assert sample(text, "db_query_duration_seconds_count") >= 2
+    assert sample(text, 'cache_requests_total{result="hits"}') == 1
+    assert sample(text, "http_requests_in_flight") == 1  # the /metrics request itself
+    assert sample(text, 'db_statement_cache_total{result="miss"}') >= 1
+    assert sample(text, "changes_published_total") >= 1
+
+
+def test_change_streams_are_counted_but_not_timed(monkeypatch):
+    feed = ChangeFeed()
+    monkeypatch.setattr(routes, "changes", feed)
+    feed.close()  # the stream ends right after its headers
+    client.get("/api/v1/items/changes")
+    with client.websocket_connect("/api/v1/items/changes/ws"):
+        pass
+
+    text = client.get("/metrics").text
+    assert sample(text, 'http_requests_total{method="GET",route="/items/changes",status="200"}') == 1
+    assert "/items/changes/ws" not in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/items/changes"' not in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/changes"' not in text
+    assert sample(text, "http_requests_in_flight") == 1
+
+
+def test_streamed_export_is_exempt_from_the_row_budget(fresh_metrics, monkeypatch):
+    for i in range(1, 4):
+        fresh_metrics.insert_data("items", [i, f"course {i}", "desc", 1.0])
+    monkeypatch.setattr(instrument.query_monitor, "row_budget", 2)
+    monkeypatch.setattr(instrument.query_monitor, "strict", True)
+
+    resp = client.get("/api/v1/items/export")
+    assert resp.status_code == 200
+    assert len(resp.text.splitlines()) == 3  # not cut short
+    assert "x-db-budget-exceeded" not in resp.headers
+    assert client.get("/api/v1/items/").status_code == 500  # other reads are still held to it
+
+
+def test_statement_compiles_are_reported_per_route():
+    client.post("/api/v1/items/", json={"id": 1, "name": "a", "description": "d", "price": 1.0})
+    client.put("/api/v1/items/1", json={"price": 2.0}, headers={"If-Match": "*"})
+    text = client.get("/metrics").text
+    # Fresh engine: the first request on each route compiles its statements.
+    assert sample(text, 'http_request_db_compiles_total{method="POST",route="/items/"}') >= 1
+
+    before = instrument.query_monitor.statement_cache["miss"]
+    client.put("/api/v1/items/1", json={"price": 3.0}, headers={"If-Match": "*"})
+    assert instrument.query_monitor.statement_cache["miss"] == before
+
+
+def test_slow_queries_are_logged_with_route(monkeypatch, caplog):
+    monkeypatch.setattr(instrument.query_monitor, "slow_query_seconds", 1e-9)
+    with caplog.at_level(logging.WARNING, logger="db.instrument"):
+        client.get("/api/v1/items/1")
+    slow = [r.getMessage() for r in caplog.records if r.name == "db.instrument"]
+    assert slow and "/items/{item_id}" in slow[0] and "SELECT" in slow[0]
+    assert "parameters: (1," in slow[0]
+
+
+def test_query_budget_flags_and_strict_mode(fresh_metrics, monkeypatch):
+    for i in range(1, 4):
+        fresh_metrics.insert_data("items", [i, f"course {i}", "desc", 1.0])
+    monkeypatch.setattr(instrument.query_monitor, "row_budget", 2)
+
+    resp = client.get("/api/v1/items/")
+    assert resp.status_code == 200
+    assert resp.headers["x-db-budget-exceeded"] == "rows=3/2"
+    assert "x-db-budget-exceeded" not in client.get("/api/v1/items/1").headers
+    assert sample(client.get("/metrics").text, 'http_requests_over_budget_total{method="GET",route="/items/"}') == 1
+
+    monkeypatch.setattr(instrument.query_monitor, "strict", True)
+    monkeypatch.setattr(instrument.query_monitor, "query_budget", 1)
+    resp = client.get("/api/v1/items/", params={"limit": 1, "after": 1})
+    assert resp.status_code == 200  # one query, two rows: within budget
+    resp = client.put("/api/v1/items/2", json={"price": 2.0}, headers={"If-Match": "*"})
+    assert resp.status_code == 500 and "more than 1 queries" in resp.json()["detail"]
@@ -1,4 +1,7 @@
+import os
 import pytest
+from sqlalchemy import inspect
+from db.instrument import query_monitor
 from db.ops import SQLAlchemyOps
 
 def test_create_table():
@@ -7,3 +10,180 @@ def test_create_table():
     result = db_ops.fetch_data('test_table')
     assert result == []
     db_ops.close_connection()
+
+
+def test_table_reflection_is_cached():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('test_table', ['id', 'name', 'value'])
+    db_ops.invalidate_table('test_table')
+
+    db_ops.insert_data('test_table', [1, 'foo', 'bar'])
+    db_ops.fetch_data('test_table')
+    db_ops.update_data('test_table', {'name': 'baz'}, {'id': 1})
+    db_ops.delete_data('test_table', {'id': 1})
+
+    stats = db_ops.table_cache_stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 3
+    db_ops.close_connection()
+
+
+def test_create_table_invalidates_cached_table():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('test_table', ['id', 'name'])
+    db_ops.create_table('test_table', ['id', 'name', 'value'])
+    db_ops.insert_data('test_table', [1, 'foo', 'bar'])
+    assert db_ops.fetch_data('test_table') == [{'id': 1, 'name': 'foo', 'value': 'bar'}]
+    assert db_ops.table_cache_stats()['misses'] == 0
+    db_ops.close_connection()
+
+
+def test_hot_statements_are_prebuilt_and_stay_compiled():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('items')
+
+    def round_trip(item_id):
+        db_ops.insert_data('items', [item_id, 'course', 'desc', 1.0])
+        assert db_ops.fetch_one('items', item_id)['name'] == 'course'
+        db_ops.fetch_page('items', 10)
+        db_ops.fetch_page('items', 10, after=item_id - 1)
+        assert db_ops.update_returning('items', {'price': 2.0}, {'id': item_id})[0]['price'] == 2.0
+        assert db_ops.delete_data('items', {'id': item_id}) == 1
+
+    round_trip(1)
+    statements = db_ops._table_statements(db_ops.get_table('items'))
+    misses = query_monitor.statement_cache['miss']
+    round_trip(2)
+    assert query_monitor.statement_cache['miss'] == misses
+    assert db_ops._table_statements(db_ops.get_table('items')) is statements
+    assert db_ops.table_cache_stats()['prebuilt_statements'] == ['items']
+
+    # A schema change drops the statements built for the old table.
+    db_ops.create_table('items')
+    assert db_ops.table_cache_stats()['prebuilt_statements'] == []
+    db_ops.close_connection()
+
+
+def test_update_returning_and_fetch_one():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('test_table', ['id', 'name', 'value'])
+    db_ops.insert_data('test_table', [1, 'foo', 'bar'])
+
+    assert db_ops.update_returning('test_table', {'name': 'baz'}, {'id': 1}) == [
+        {'id': 1, 'name': 'baz', 'value': 'bar'}
+    ]
+    assert db_ops.update_returning('test_table', {'name': 'baz'}, {'id': 2}) == []
+    assert db_ops.fetch_one('test_table', 1)['name'] == 'baz'
+    assert db_ops.fetch_one('test_table', 2) is None
+    db_ops.close_connection()
+
+
+def test_migrate_legacy_items_table():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('items', ['id', 'name', 'description', 'price'])
+    db_ops.insert_data('items', [1, 'Python', 'desc', '99.99'])
+    assert not db_ops.schema_matches('items')
+
+    assert db_ops.migrate_table('items') is True
+    assert db_ops.schema_matches('items')
+    assert db_ops.migrate_table('items') is False
+
+    inspector = inspect(db_ops.engine)
+    assert inspector.get_pk_constraint('items')['constrained_columns'] == ['id']
+    assert {ix['name'] for ix in inspector.get_indexes('items')} == {'ix_items_name', 'ix_items_price'}
+    assert db_ops.fetch_data('items') == [{'id': 1, 'name': 'Python', 'description': 'desc', 'price': 99.99}]
+    db_ops.close_connection()
+
+
+def test_ensure_table_is_idempotent_and_keeps_rows():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    assert db_ops.ensure_table('items') is True
+    db_ops.insert_data('items', [1, 'Python', 'desc', 99.99])
+
+    assert db_ops.ensure_table('items') is False
+    assert len(db_ops.fetch_data('items')) == 1
+    db_ops.close_connection()
+
+
+def test_ensure_table_migrates_legacy_table():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.create_table('items', ['id', 'name', 'description', 'price'])
+    db_ops.insert_data('items', [1, 'Python', 'desc', '99.99'])
+
+    assert db_ops.ensure_table('items') is True
+    assert db_ops.schema_matches('items')
+    assert db_ops.fetch_one('items', 1)['price'] == 99.99
+    db_ops.close_connection()
+
+
+def test_bulk_insert_skips_bad_rows():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.ensure_table('items')
+    rows = [
+        {'id': i, 'name': f'course {i}', 'description': 'desc', 'price': 1.0}
+        for i in range(10)
+    ]
+    rows[4]['id'] = 3  # duplicate primary key
+
+    inserted, errors = db_ops.bulk_insert('items', rows, batch_size=3)
+    assert inserted == 9
+    assert [index for index, _ in errors] == [4]
+    assert len(db_ops.fetch_data('items')) == 9
+    db_ops.close_connection()
+
+
+def test_iter_data_streams_in_batches():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.ensure_table('items')
+    db_ops.bulk_insert('items', [
+        {'id': i, 'name': f'course {i}', 'description': 'desc', 'price': float(i)}
+        for i in range(7, 0, -1)
+    ])
+
+    batches = list(db_ops.iter_data('items', batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [row['id'] for batch in batches for row in batch] == list(range(1, 8))
+    filtered = list(db_ops.iter_data('items', {'price__gte': 6}))
+    assert [row['id'] for batch in filtered for row in batch] == [6, 7]
+    db_ops.close_connection()
+
+
+def test_set_based_bulk_writes_return_affected_keys():
+    db_ops = SQLAlchemyOps(database_url="sqlite://")
+    db_ops.ensure_table('items')
+    db_ops.bulk_insert('items', [
+        {'id': i, 'name': f'course {i}', 'description': 'desc', 'price': float(i)}
+        for i in range(1, 6)
+    ])
+
+    assert db_ops.update_many('items', [{'id': 1, 'price': 9.0}, {'id': 2, 'name': 'x'}, {'id': 42, 'price': 1.0}]) == 2
+    assert db_ops.update_where('items', {'price': 7.0}, {'id__in': [3, 4]}) == [3, 4]
+    assert sorted(db_ops.delete_where('items', {'price__gte': 7})) == [1, 3, 4]
+    assert [row['name'] for row in db_ops.fetch_data('items')] == ['x', 'course 5']
+    db_ops.close_connection()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "postgresql"])
+def test_explicit_ids_and_generated_ids_interleave(backend, tmp_path):
+    # Two connections generate ids while one of them writes an explicit id
+    # just ahead of the sequence; nobody may be handed an id twice.
+    if backend == "sqlite":
+        url = f"sqlite:///{tmp_path / 'ids.db'}"
+    else:
+        url = os.getenv("DATABASE_URL")
+        if not url:
+            pytest.skip("DATABASE_URL not set, skipping PostgreSQL identity test")
+    first, second = SQLAlchemyOps(database_url=url), SQLAlchemyOps(database_url=url)
+    try:
+        first.create_table('items')
+        course = lambda name, **extra: {'name': name, 'description': 'd', 'price': 1.0, **extra}
+        ids = [first.insert_returning('items', course('a'))['id'],
+               second.insert_returning('items', course('b'))['id']]
+        ids.append(second.insert_returning('items', course('explicit', id=max(ids) + 1))['id'])
+        for ops in (first, second, first, second):
+            ids.append(ops.insert_returning('items', course('generated'))['id'])
+        assert len(set(ids)) == len(ids) == 7
+        assert ids[3:] == sorted(ids[3:]) and min(ids[3:]) > ids[2]
+    finally:
+        first.close_connection()
+        second.close_connection()
@@ -1,8 +1,8 @@
 import Inputpanel from './components/Inputpanel';
 import Table from './components/Table';
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import './App.css';
-import { fetchCourses, createCourse, updateCourse, deleteCourse } from './api';
+import { fetchCourses, searchCourses, createCourse, updateCourse, deleteCourse, subscribeToChanges } from './api';
 
 function App() {
   const [courses, setCourses] = useState([]);
@@ -10,16 +10,47 @@ function App() {
   const [selectedCourse, setSelectedCourse] = useState(null);
   const [refresh, setRefresh] = useState(false);
   const [alertMsg, setAlertMsg] = useState(null);
+  const [query, setQuery] = useState('');
+  // The change stream is opened once; its handler reads the current query here.
+  const queryRef = useRef(query);
+  queryRef.current = query;
 
   useEffect(() => {
-    fetchCourses().then(setCourses);
-  }, [refresh]);
+    // Searches run on the server; wait for a pause in typing before sending one.
+    const timer = setTimeout(() => {
+      (query.trim() ? searchCourses(query) : fetchCourses()).then(setCourses);
+    }, query ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [refresh, query]);
+
+  useEffect(() => {
+    // Apply changes from other clients as they happen. Search results are
+    // ranked, so those are reloaded.
+    const reload = () => setRefresh((r) => !r);
+    return subscribeToChanges((change) => {
+      if (queryRef.current.trim()) {
+        reload();
+        return;
+      }
+      setCourses((current) => {
+        const rest = current.filter((course) => course.id !== change.id);
+        if (change.op === 'delete') return rest;
+        if (!change.row) {
+          reload();
+          return current;
+        }
+        return [...rest, change.row].sort((a, b) => a.id - b.id);
+      });
+    }, reload);
+  }, []);
 
   const handleSubmit = async (form) => {
     try {
       let res;
       if (selectedAction === 'Create') {
-        res = await createCourse(form);
+        // A blank ID is left to the server, which assigns the next one.
+        const { id, ...fields } = form;
+        res = await createCourse(id === '' ? fields : form);
         setAlertMsg(res.message || 'Course created!');
       } else if (selectedAction === 'Update') {
         res = await updateCourse(form.id, form);
@@ -28,6 +59,8 @@ function App() {
         res = await deleteCourse(form.id);
         setAlertMsg(res.message || 'Course deleted!');
       }
+      // The change stream may only carry this worker's writes (see the
+      // backend's change feed), so don't rely on it for our own.
       setRefresh((r) => !r);
     } catch (e) {
       setAlertMsg('Operation failed: ' + (e.message || 'Unknown error'));
@@ -71,6 +104,13 @@ function App() {
         </div>
         <div className='col-span-2 flex flex-col gap-4'>
           <div className="mb-6">
+            <input
+              type="search"
+              className="w-full mb-4 px-4 py-2 rounded-lg border border-gray-300 shadow"
+              placeholder="Search courses..."
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+            />
             <Table courses={courses} />
           </div>
           <div>
@@ -1,14 +1,48 @@
 const BASE_URL = 'http://localhost:8000/items/';
 
+// The list endpoint returns one page at a time; follow next_cursor until
+// the last page so every course is shown.
 export async function fetchCourses() {
   try {
-    const response = await fetch(BASE_URL);
+    const courses = [];
+    let cursor = null;
+    do {
+      const url = cursor ? `${BASE_URL}?after=${encodeURIComponent(cursor)}` : BASE_URL;
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error('Failed to fetch courses');
+      }
+      const page = await response.json();
+      courses.push(...page.items);
+      cursor = page.next_cursor;
+    } while (cursor);
+    return courses;
+  } catch (error) {
+    console.error('Error fetching courses:', error);
+    return [];
+  }
+}
+
+// Calls onChange({ op, id, row }) for every course change, and onReset()
+// when the changes can't be replayed and the list should be reloaded.
+// EventSource reconnects by itself and resumes where it left off.
+export function subscribeToChanges(onChange, onReset) {
+  const source = new EventSource(`${BASE_URL}changes`);
+  source.addEventListener('change', (event) => onChange(JSON.parse(event.data)));
+  source.addEventListener('reset', () => onReset());
+  return () => source.close();
+}
+
+export async function searchCourses(query) {
+  try {
+    const response = await fetch(`${BASE_URL}search?q=${encodeURIComponent(query)}`);
     if (!response.ok) {
-      throw new Error('Failed to fetch courses');
+      throw new Error('Failed to search courses');
     }
-    return await response.json();
+    const results = await response.json();
+    return results.items;
   } catch (error) {
-    console.error('Error fetching courses:', error);
+    console.error('Error searching courses:', error);
     return [];
   }
 }